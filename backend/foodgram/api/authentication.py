@@ -0,0 +1,119 @@
+import copy
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from core.caches import is_shared
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.authentication import TokenAuthentication
+
+from .constants import (AUTH_TOKEN_CACHE_MAX_SIZE, AUTH_TOKEN_CACHE_TTL,
+                        AUTH_TOKEN_LOCAL_CACHE_TTL)
+
+AUTH_TOKEN_KEY = 'auth_token:{}'
+AUTH_TOKEN_GENERATION_KEY = 'auth_token:generation'
+
+
+class TokenCache:
+    """LRU токен -> пользователь с TTL в памяти процесса.
+
+    Записи дублируются в общем кеше Django AUTH_TOKEN_CACHE, а смена
+    номера поколения в нём при инвалидации очищает локальные LRU
+    остальных процессов. Без общего кеша (AUTH_TOKEN_CACHE пуст или
+    указывает на LocMemCache) записи живут только в LRU процесса и не
+    дольше local_ttl: выход или деактивация в одном воркере доходят до
+    остальных с этой задержкой.
+    """
+
+    def __init__(self, max_size, ttl, local_ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.local_ttl = local_ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._generation = None
+
+    @property
+    def shared(self):
+        if settings.AUTH_TOKEN_CACHE:
+            shared = caches[settings.AUTH_TOKEN_CACHE]
+            if is_shared(shared):
+                return shared
+        return None
+
+    def get_shared_key(self, key):
+        return AUTH_TOKEN_KEY.format(hashlib.sha256(key.encode()).hexdigest())
+
+    def get(self, key):
+        shared = self.shared
+        if shared is not None:
+            generation = shared.get(AUTH_TOKEN_GENERATION_KEY)
+            if generation != self._generation:
+                with self._lock:
+                    self._entries.clear()
+                    self._generation = generation
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[1] > time.monotonic():
+                    self._entries.move_to_end(key)
+                    return entry[0]
+                del self._entries[key]
+        if shared is None:
+            return None
+        user = shared.get(self.get_shared_key(key))
+        if user is not None:
+            self.set_local(key, user, self.ttl)
+        return user
+
+    def set_local(self, key, user, ttl):
+        with self._lock:
+            self._entries[key] = (user, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def set(self, key, user):
+        shared = self.shared
+        user = copy.deepcopy(user)
+        if shared is None:
+            self.set_local(key, user, self.local_ttl)
+            return
+        self.set_local(key, user, self.ttl)
+        shared.set(self.get_shared_key(key), user, self.ttl)
+
+    def invalidate(self, keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+        shared = self.shared
+        if shared is not None:
+            shared.delete_many([self.get_shared_key(key) for key in keys])
+            shared.set(AUTH_TOKEN_GENERATION_KEY, uuid.uuid4().hex, None)
+
+
+token_cache = TokenCache(AUTH_TOKEN_CACHE_MAX_SIZE, AUTH_TOKEN_CACHE_TTL,
+                         AUTH_TOKEN_LOCAL_CACHE_TTL)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication без запроса к базе для известных токенов.
+
+    Пользователь по токену берётся из token_cache, в базу уходит только
+    первый запрос с токеном (без общего кеша - первый в каждом воркере
+    раз в AUTH_TOKEN_LOCAL_CACHE_TTL). Записи удаляются сигналами при
+    удалении токена и изменении или удалении пользователя.
+    """
+
+    def authenticate_credentials(self, key):
+        user = token_cache.get(key)
+        if user is None:
+            user, token = super().authenticate_credentials(key)
+            token_cache.set(key, user)
+            return user, token
+        user = copy.deepcopy(user)
+        token = self.get_model()(key=key, user=user)
+        return user, token
@@ -0,0 +1,78 @@
+import heapq
+import threading
+import time
+import uuid
+from bisect import bisect_left
+
+from django.core.cache import cache
+from recipes.models import Ingredient
+
+from .constants import INGREDIENT_INDEX_TTL
+
+INGREDIENT_INDEX_VERSION_KEY = 'ingredient_index:version'
+
+
+def normalize(value):
+    return value.strip().lower().replace('ё', 'е')
+
+
+class IngredientIndex:
+    """Отсортированный по названию список ингредиентов в памяти процесса.
+
+    Совпадения по началу названия ищутся бинарным поиском, по вхождению -
+    проходом по списку. Индекс перестраивается при изменении версии
+    в кеше (её меняют сигналы Ingredient) или по истечении TTL.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = None
+        self._version = None
+        self._built_at = 0
+
+    def invalidate(self):
+        self._data = None
+        cache.set(INGREDIENT_INDEX_VERSION_KEY, uuid.uuid4().hex, None)
+
+    def is_current(self, data, version):
+        return (data is not None and version == self._version
+                and time.monotonic() - self._built_at <= INGREDIENT_INDEX_TTL)
+
+    def get_data(self):
+        version = cache.get(INGREDIENT_INDEX_VERSION_KEY)
+        data = self._data
+        if not self.is_current(data, version):
+            with self._lock:
+                data = self._data
+                if not self.is_current(data, version):
+                    items = sorted(
+                        Ingredient.objects.values('id', 'name',
+                                                  'measurement_unit'),
+                        key=lambda item: (normalize(item['name']),
+                                          item['id']))
+                    data = [normalize(item['name']) for item in items], items
+                    self._data = data
+                    self._version = version
+                    self._built_at = time.monotonic()
+        return data
+
+    def search(self, query, limit):
+        """Сначала совпадения по началу названия, затем по вхождению"""
+        query = normalize(query)
+        keys, items = self.get_data()
+        start = bisect_left(keys, query)
+        end = start
+        while end < len(keys) and keys[end].startswith(query):
+            end += 1
+        result = items[start:min(end, start + limit)]
+        if len(result) < limit:
+            matches = heapq.nsmallest(
+                limit - len(result),
+                ((key.find(query), key, index)
+                 for index, key in enumerate(keys)
+                 if not start <= index < end and query in key))
+            result += [items[index] for _, _, index in matches]
+        return result
+
+
+ingredient_index = IngredientIndex()
@@ -1 +1,35 @@
 TRUE_FILTER = '1'
+RECIPES_LIMIT = 'recipes_limit'
+SHOPPING_CART_CHUNK_SIZE = 2000
+SHOPPING_CART_CACHE_TIMEOUT = 60 * 60
+SHOPPING_CART_CACHE_MAX_SIZE = 1024 * 1024
+INGREDIENT_SEARCH_PARAM = 'name'
+INGREDIENT_SEARCH_LIMIT = 20
+INGREDIENT_SEARCH_MAX_LIMIT = 100
+INGREDIENT_INDEX_TTL = 5 * 60
+REFERENCE_CACHE_TIMEOUT = 24 * 60 * 60
+REFERENCE_CACHE_MAX_AGE = 60
+APPROXIMATE_COUNT_THRESHOLD = 100000
+RECIPE_IMAGE_MAX_SIZE = 10 * 1024 * 1024
+RECIPE_IMAGE_MAX_DIMENSION = 8000
+POPULAR_ORDERING = 'popular'
+TRENDING_ORDERING = 'trending'
+SEARCH_CONFIG = 'russian'
+COOK_INGREDIENTS_PARAM = 'ingredients'
+COOK_RANK_PARAM = 'rank'
+COOK_RANK_MISSING = 'missing'
+COOK_MAX_INGREDIENTS = 100
+COOK_WINDOW_MAX = 2000
+RECIPE_INDEX_MAX_CHANGES = 1000
+RECIPE_INDEX_CHANGES_TIMEOUT = 24 * 60 * 60
+RECIPE_INDEX_LOCAL_TTL = 5 * 60
+TAGS_MODE_ANY = 'any'
+TAGS_MODE_ALL = 'all'
+AUTH_TOKEN_CACHE_MAX_SIZE = 10000
+AUTH_TOKEN_CACHE_TTL = 5 * 60
+AUTH_TOKEN_LOCAL_CACHE_TTL = 10
+BATCH_MAX_SIZE = 100
+SIMILAR_RECIPES_MAX = 100
+MINHASH_HASHES = 48
+MINHASH_BAND_ROWS = 3
+MINHASH_SEED = 1
@@ -1,12 +1,100 @@
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Exists, F, FloatField, OuterRef, Q
+from django.db.models.functions import Cast
 from django_filters import FilterSet, filters
 from recipes.models import Recipe, Tag
 
+from .constants import (POPULAR_ORDERING, REFERENCE_CACHE_TIMEOUT,
+                        SEARCH_CONFIG, TAGS_MODE_ALL, TAGS_MODE_ANY,
+                        TRENDING_ORDERING)
+from .mixins import get_cache_state, get_cache_timeout
+
+TAG_MAP_KEY = 'tag_map:{}'
+
+
+def get_tag_map():
+    """Словарь slug -> id тегов из кеша, по версии данных Tag"""
+    version, _ = get_cache_state(Tag)
+    key = TAG_MAP_KEY.format(version)
+    tag_map = cache.get(key)
+    if tag_map is None:
+        tag_map = dict(Tag.objects.values_list('slug', 'id'))
+        cache.set(key, tag_map, get_cache_timeout(REFERENCE_CACHE_TIMEOUT))
+    return tag_map
+
+
+def get_tag_choices():
+    return [(slug, slug) for slug in get_tag_map()]
+
 
 class RecipeFilter(FilterSet):
-    tags = filters.ModelMultipleChoiceFilter(field_name='tags__slug',
-                                             queryset=Tag.objects.all(),
-                                             to_field_name='slug')
+    tags = filters.MultipleChoiceFilter(choices=get_tag_choices,
+                                        method='filter_tags')
+    tags_mode = filters.ChoiceFilter(
+        choices=((TAGS_MODE_ANY, 'Любой из тегов'),
+                 (TAGS_MODE_ALL, 'Все теги')),
+        method='filter_tags_mode')
+    search = filters.CharFilter(method='filter_search')
+    ordering = filters.ChoiceFilter(
+        choices=((POPULAR_ORDERING, 'Популярные'),
+                 (TRENDING_ORDERING, 'Популярные сейчас')),
+        method='filter_ordering')
 
     class Meta:
         model = Recipe
         fields = ['tags', 'author']
+
+    def filter_tags(self, queryset, name, value):
+        """Фильтр по тегам через EXISTS по таблице связей.
+
+        В отличие от JOIN не размножает строки рецептов, поэтому не нужен
+        distinct(). С tags_mode=all рецепт должен иметь все теги.
+        """
+        tag_map = get_tag_map()
+        tag_ids = {tag_map[slug] for slug in value if slug in tag_map}
+        recipe_tags = Recipe.tags.through.objects.filter(
+            recipe_id=OuterRef('pk'))
+        if self.form.cleaned_data.get('tags_mode') == TAGS_MODE_ALL:
+            for tag_id in tag_ids:
+                queryset = queryset.filter(
+                    Exists(recipe_tags.filter(tag_id=tag_id)))
+            return queryset
+        return queryset.filter(
+            Exists(recipe_tags.filter(tag_id__in=tag_ids)))
+
+    def filter_tags_mode(self, queryset, name, value):
+        return queryset
+
+    def filter_search(self, queryset, name, value):
+        """Полнотекстовый поиск по названию и тексту рецепта.
+
+        На PostgreSQL использует поисковый вектор с GIN-индексом и
+        сортирует по релевантности, на других СУБД - поиск по подстроке.
+        """
+        value = value.strip()
+        if not value:
+            return queryset
+        if connection.vendor != 'postgresql':
+            return queryset.filter(
+                Q(name__icontains=value) | Q(text__icontains=value))
+        query = SearchQuery(value, config=SEARCH_CONFIG,
+                            search_type='websearch')
+        # ts_rank возвращает real, его текстовое представление неточно;
+        # double precision возвращается без потерь, и значение из курсора
+        # пагинации совпадает с рангом строки
+        return (queryset.filter(search_vector=query)
+                .annotate(rank=Cast(SearchRank(F('search_vector'), query),
+                                    FloatField()))
+                .order_by('-rank', '-pub_date'))
+
+    def filter_ordering(self, queryset, name, value):
+        """Сортировка по заранее посчитанным полям с индексами:
+        favourites_count - счётчик избранного, trending_score -
+        затухающий со временем счёт, см. recipes.trending"""
+        if value == POPULAR_ORDERING:
+            return queryset.order_by('-favourites_count', '-pub_date')
+        if value == TRENDING_ORDERING:
+            return queryset.order_by('-trending_score', '-pub_date')
+        return queryset
@@ -0,0 +1,368 @@
+import base64
+import json
+import math
+import platform
+import shutil
+import tempfile
+import time
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (CaptureQueriesContext, override_settings,
+                               setup_test_environment,
+                               teardown_test_environment)
+from django.urls import URLPattern, URLResolver, resolve
+from recipes.models import Favourite, Ingredient, Recipe, ShoppingList, Tag
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from users.models import CustomUser, Subscription
+
+from api import urls
+
+PASSWORD = 'benchmark-password'
+IMAGE = base64.b64decode(
+    'iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAC'
+    'hwGA60e6kgAAAABJRU5ErkJggg==')
+IMAGE_DATA = 'data:image/png;base64,' + base64.b64encode(IMAGE).decode()
+MIN_REGRESSION_MS = 1.0
+BENCHMARK_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'benchmark',
+    }
+}
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    return values[max(math.ceil(percent / 100 * len(values)) - 1, 0)]
+
+
+def get_url_names(patterns):
+    """Имена всех маршрутов из urlpatterns, включая вложенные"""
+    names = set()
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            names |= get_url_names(pattern.url_patterns)
+        elif isinstance(pattern, URLPattern) and pattern.name:
+            names.add(pattern.name)
+    return names
+
+
+class Command(BaseCommand):
+    help = ('Замеряет время ответа, число запросов к базе и размер ответа '
+            'каждого маршрута API на синтетических данных во временной '
+            'тестовой базе.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--warmup', type=int, default=2)
+        parser.add_argument('--output', default='benchmark.json')
+        parser.add_argument('--compare',
+                            help='JSON-файл предыдущего запуска')
+        parser.add_argument('--threshold', type=float, default=20.0,
+                            help='допустимый рост p50, в процентах')
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--recipes', type=int, default=1000)
+        parser.add_argument('--ingredients-per-recipe', type=int, default=8)
+        parser.add_argument('--favourites', type=int, default=5000)
+        parser.add_argument('--carts', type=int, default=2000)
+        parser.add_argument('--subscriptions', type=int, default=1000)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        previous = None
+        if options['compare']:
+            try:
+                with open(options['compare'], encoding='utf-8') as file:
+                    previous = json.load(file)
+            except (OSError, ValueError) as error:
+                raise CommandError(error)
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0,
+                                                      autoclobber=True)
+        media_root = tempfile.mkdtemp()
+        try:
+            with override_settings(MEDIA_ROOT=media_root,
+                                   CACHES=BENCHMARK_CACHES):
+                call_command(
+                    'generate_data', stdout=self.stdout,
+                    **{name: options[name] for name in (
+                        'users', 'recipes', 'ingredients_per_recipe',
+                        'favourites', 'carts', 'subscriptions', 'seed')})
+                results = self.run_scenarios(options['iterations'],
+                                             options['warmup'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            shutil.rmtree(media_root, ignore_errors=True)
+
+        report = {
+            'meta': {
+                'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'database': connection.vendor,
+                'python': platform.python_version(),
+                'options': {name: options[name] for name in (
+                    'iterations', 'users', 'recipes',
+                    'ingredients_per_recipe', 'favourites', 'carts',
+                    'subscriptions', 'seed')},
+            },
+            'results': results,
+        }
+        with open(options['output'], 'w', encoding='utf-8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+        self.print_results(results)
+        self.stdout.write(f'Результаты записаны в {options["output"]}')
+
+        if previous is not None:
+            regressions = self.compare(previous['results'], results,
+                                       options['threshold'])
+            if regressions:
+                raise CommandError('Регрессии производительности:\n'
+                                   + '\n'.join(regressions))
+            self.stdout.write(self.style.SUCCESS('Регрессий нет.'))
+
+    def get_state(self):
+        user = CustomUser.objects.create_user(
+            username='benchmark', email='benchmark@example.com',
+            password=PASSWORD, first_name='Benchmark',
+            last_name='Benchmark')
+        recipes = list(Recipe.objects.order_by('id')[:60])
+        authors = list(CustomUser.objects.filter(recipes_count__gt=0)
+                       .exclude(pk=user.pk).order_by('id')[:11])
+        for recipe in recipes[:20]:
+            Favourite.objects.create(user=user, recipe=recipe)
+            ShoppingList.objects.create(user=user, recipe=recipe)
+        for author in authors[:10]:
+            Subscription.objects.create(user=user, author=author)
+        batch_authors = list(
+            CustomUser.objects.exclude(pk=user.pk)
+            .exclude(pk__in=[author.pk for author in authors])
+            .order_by('id').values_list('id', flat=True)[:10])
+        login_user = CustomUser.objects.create_user(
+            username='benchmark-login', email='benchmark-login@example.com',
+            password=PASSWORD, first_name='Benchmark',
+            last_name='Benchmark')
+        return {
+            'user': user,
+            'login_user': login_user,
+            'token': Token.objects.create(user=user).key,
+            'recipe': recipes[-1],
+            'batch_recipes': [recipe.id for recipe in recipes[30:40]],
+            'batch_authors': batch_authors,
+            'author': authors[-1],
+            'ingredients': list(Ingredient.objects.order_by('id')
+                                .values_list('id', flat=True)[:200]),
+            'recipe_ingredients': list(
+                recipes[0].ingredient.values_list('ingredient_id',
+                                                  flat=True)),
+            'tags': list(Tag.objects.values_list('id', 'slug')),
+            'created': None,
+            'login_token': None,
+        }
+
+    def get_scenarios(self, state):
+        """Шаги одной итерации: (имя, метод, путь, параметры запроса).
+
+        Путь и параметры могут быть функциями, если зависят от ответов
+        предыдущих шагов. Изменяющие запросы идут парами, чтобы каждая
+        итерация возвращала данные в исходное состояние.
+        """
+        recipe = state['recipe'].id
+        author = state['author'].id
+        ingredient = state['ingredients'][0]
+        tag_ids = [tag_id for tag_id, _ in state['tags']]
+        slugs = '&'.join(f'tags={slug}' for _, slug in state['tags'][:2])
+        cook = ','.join(map(str, state['recipe_ingredients'][:3]))
+        batch_recipes = {'data': {'ids': state['batch_recipes']},
+                         'format': 'json'}
+        batch_authors = {'data': {'ids': state['batch_authors']},
+                         'format': 'json'}
+
+        def recipe_data(name, count):
+            return {'name': name, 'text': 'Текст рецепта',
+                    'cooking_time': 10, 'image': IMAGE_DATA,
+                    'tags': tag_ids[:2],
+                    'ingredients': [{'id': ingredient_id, 'amount': 10}
+                                    for ingredient_id
+                                    in state['ingredients'][:count]]}
+
+        def created():
+            return f'/api/recipes/{state["created"]}/'
+
+        def login_headers():
+            return {'HTTP_AUTHORIZATION': f'Token {state["login_token"]}'}
+
+        def image_data():
+            return {'data': {'image': SimpleUploadedFile(
+                        'image.png', IMAGE, content_type='image/png')},
+                    'format': 'multipart'}
+
+        return [
+            ('api-root', 'get', '/api/', {}),
+            ('users-list', 'get', '/api/users/?limit=6', {}),
+            ('users-detail', 'get', f'/api/users/{author}/', {}),
+            ('users-me', 'get', '/api/users/me/', {}),
+            ('users-subscriptions', 'get',
+             '/api/users/subscriptions/?limit=6&recipes_limit=3', {}),
+            ('users-subscribe', 'post', f'/api/users/{author}/subscribe/',
+             {}),
+            ('users-unsubscribe', 'delete',
+             f'/api/users/{author}/subscribe/', {}),
+            ('users-batch-subscribe', 'post', '/api/users/subscribe/batch/',
+             batch_authors),
+            ('users-batch-unsubscribe', 'delete',
+             '/api/users/subscribe/batch/', batch_authors),
+            ('users-set-password', 'post', '/api/users/set_password/',
+             {'data': {'new_password': PASSWORD,
+                       'current_password': PASSWORD}}),
+            ('tags-list', 'get', '/api/tags/', {}),
+            ('tags-detail', 'get', f'/api/tags/{tag_ids[0]}/', {}),
+            ('ingredients-list', 'get', '/api/ingredients/', {}),
+            ('ingredients-search', 'get', '/api/ingredients/?name=мук',
+             {}),
+            ('ingredients-detail', 'get', f'/api/ingredients/{ingredient}/',
+             {}),
+            ('recipes-list', 'get', '/api/recipes/?limit=6', {}),
+            ('recipes-list-anonymous', 'get', '/api/recipes/?limit=6',
+             {'anonymous': True}),
+            ('recipes-list-cursor', 'get', '/api/recipes/?limit=6&cursor=',
+             {}),
+            ('recipes-list-tags', 'get', f'/api/recipes/?limit=6&{slugs}',
+             {}),
+            ('recipes-list-favorited', 'get',
+             '/api/recipes/?limit=6&is_favorited=1', {}),
+            ('recipes-list-search', 'get', '/api/recipes/?limit=6&search=суп',
+             {}),
+            ('recipes-list-popular', 'get',
+             '/api/recipes/?limit=6&ordering=popular', {}),
+            ('recipes-list-trending', 'get',
+             '/api/recipes/?limit=6&ordering=trending', {}),
+            ('recipes-detail', 'get', f'/api/recipes/{recipe}/', {}),
+            ('recipes-cook', 'get',
+             f'/api/recipes/cook/?limit=6&ingredients={cook}', {}),
+            ('recipes-similar', 'get',
+             f'/api/recipes/{recipe}/similar/?limit=6', {}),
+            ('recipes-feed', 'get', '/api/recipes/feed/?limit=6', {}),
+            ('recipes-create', 'post', '/api/recipes/',
+             {'data': recipe_data('Рецепт для замеров', 10),
+              'format': 'json', 'save': ('created', 'id')}),
+            ('recipes-update', 'patch', created,
+             {'data': recipe_data('Рецепт для замеров', 12),
+              'format': 'json'}),
+            ('recipes-image', 'put', lambda: created() + 'image/',
+             image_data),
+            ('recipes-delete', 'delete', created, {}),
+            ('recipes-favorite', 'post', f'/api/recipes/{recipe}/favorite/',
+             {}),
+            ('recipes-unfavorite', 'delete',
+             f'/api/recipes/{recipe}/favorite/', {}),
+            ('recipes-shopping-cart', 'post',
+             f'/api/recipes/{recipe}/shopping_cart/', {}),
+            ('recipes-shopping-cart-delete', 'delete',
+             f'/api/recipes/{recipe}/shopping_cart/', {}),
+            ('recipes-batch-favorite', 'post', '/api/recipes/favorite/batch/',
+             batch_recipes),
+            ('recipes-batch-unfavorite', 'delete',
+             '/api/recipes/favorite/batch/', batch_recipes),
+            ('recipes-batch-shopping-cart', 'post',
+             '/api/recipes/shopping_cart/batch/', batch_recipes),
+            ('recipes-batch-shopping-cart-delete', 'delete',
+             '/api/recipes/shopping_cart/batch/', batch_recipes),
+            ('recipes-download-shopping-cart', 'get',
+             '/api/recipes/download_shopping_cart/', {}),
+            ('recipes-download-shopping-cart-csv', 'get',
+             '/api/recipes/download_shopping_cart/?format=csv', {}),
+            ('auth-login', 'post', '/api/auth/token/login/',
+             {'data': {'email': state['login_user'].email,
+                       'password': PASSWORD},
+              'anonymous': True, 'save': ('login_token', 'auth_token')}),
+            ('auth-logout', 'post', '/api/auth/token/logout/',
+             lambda: {'anonymous': True, 'extra': login_headers()}),
+        ]
+
+    def run_scenarios(self, iterations, warmup):
+        state = self.get_state()
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {state["token"]}')
+        anonymous = APIClient()
+        scenarios = self.get_scenarios(state)
+        measurements = {name: [] for name, _, _, _ in scenarios}
+        statuses = {}
+        covered = set()
+
+        for iteration in range(warmup + iterations):
+            for name, method, path, params in scenarios:
+                path = path() if callable(path) else path
+                params = dict(params() if callable(params) else params)
+                save = params.pop('save', None)
+                extra = params.pop('extra', {})
+                api = anonymous if params.pop('anonymous', False) else client
+                with CaptureQueriesContext(connection) as queries:
+                    started = time.perf_counter()
+                    response = getattr(api, method)(path, **params, **extra)
+                    content = (b''.join(response.streaming_content)
+                               if response.streaming else response.content)
+                    elapsed = time.perf_counter() - started
+                if save and response.status_code < 400:
+                    state[save[0]] = json.loads(content)[save[1]]
+                statuses[name] = response.status_code
+                covered.add(resolve(path.split('?')[0]).url_name)
+                if iteration >= warmup:
+                    measurements[name].append(
+                        (elapsed * 1000, len(queries), len(content)))
+
+        for name, status in statuses.items():
+            if status >= 400:
+                self.stderr.write(self.style.WARNING(
+                    f'{name}: ответ {status}'))
+        missing = get_url_names(urls.urlpatterns) - covered
+        if missing:
+            self.stderr.write(self.style.WARNING(
+                'Маршруты без замеров: ' + ', '.join(sorted(missing))))
+
+        results = {}
+        for name, values in measurements.items():
+            latencies = [latency for latency, _, _ in values]
+            results[name] = {
+                'status': statuses[name],
+                'requests': len(values),
+                'p50_ms': round(percentile(latencies, 50), 3),
+                'p90_ms': round(percentile(latencies, 90), 3),
+                'p99_ms': round(percentile(latencies, 99), 3),
+                'mean_ms': round(sum(latencies) / len(latencies), 3),
+                'queries': max(count for _, count, _ in values),
+                'bytes': max(size for _, _, size in values),
+            }
+        return results
+
+    def print_results(self, results):
+        self.stdout.write('{:<40}{:>10}{:>10}{:>10}{:>9}{:>10}'.format(
+            'Маршрут', 'p50, мс', 'p90, мс', 'p99, мс', 'Запросы', 'Байт'))
+        for name, result in results.items():
+            self.stdout.write(
+                '{:<40}{:>10.2f}{:>10.2f}{:>10.2f}{:>9}{:>10}'.format(
+                    name, result['p50_ms'], result['p90_ms'],
+                    result['p99_ms'], result['queries'], result['bytes']))
+
+    def compare(self, previous, results, threshold):
+        """Рост p50 больше порога или любой рост числа запросов"""
+        regressions = []
+        for name, result in results.items():
+            before = previous.get(name)
+            if before is None:
+                continue
+            if (result['p50_ms'] > before['p50_ms'] * (1 + threshold / 100)
+                    and result['p50_ms'] - before['p50_ms']
+                    > MIN_REGRESSION_MS):
+                regressions.append(
+                    f'{name}: p50 {before["p50_ms"]} -> '
+                    f'{result["p50_ms"]} мс')
+            if result['queries'] > before['queries']:
+                regressions.append(
+                    f'{name}: запросов {before["queries"]} -> '
+                    f'{result["queries"]}')
+        return regressions
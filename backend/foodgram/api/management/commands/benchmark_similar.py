@@ -0,0 +1,177 @@
+import os
+import random
+import tempfile
+import time
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+
+from api.constants import MINHASH_BAND_ROWS, MINHASH_HASHES
+from api.recipe_index import RecipeIngredientIndex
+from api.similarity import RecipeSimilarityIndex
+
+from .benchmark import percentile
+
+TOP = 10
+
+
+class RowsMixin:
+    """Берёт ингредиенты рецептов из словаря вместо базы; индекс
+    строится явно, журнал изменений в кеше не читается"""
+
+    def __init__(self, ingredients, **kwargs):
+        super().__init__(**kwargs)
+        self.source = ingredients
+
+    def get_rows(self, recipe_ids=None):
+        if recipe_ids is None:
+            recipe_ids = sorted(self.source)
+        return [(recipe_id, ingredient_id)
+                for recipe_id in sorted(recipe_ids)
+                for ingredient_id in self.source.get(recipe_id, ())]
+
+    def sync(self):
+        pass
+
+
+class SimilarityIndex(RowsMixin, RecipeSimilarityIndex):
+    pass
+
+
+class IngredientIndex(RowsMixin, RecipeIngredientIndex):
+    pass
+
+
+def generate(recipes, ingredients, per_recipe, seed):
+    """Синтетический каталог: рецепты - вариации общих заготовок,
+    популярность ингредиентов убывает по закону Ципфа"""
+    generator = random.Random(seed)
+    ingredient_ids = list(range(1, ingredients + 1))
+    weights = [1 / rank for rank in ingredient_ids]
+
+    def sample(count):
+        result = set()
+        while len(result) < count:
+            result.update(generator.choices(ingredient_ids, weights,
+                                            k=count - len(result)))
+        return result
+
+    bases = [sample(per_recipe) for _ in range(max(recipes // 20, 1))]
+    catalogue = {}
+    for recipe_id in range(1, recipes + 1):
+        base = generator.choice(bases)
+        keep = generator.sample(sorted(base), generator.randint(
+            len(base) // 2, len(base)))
+        catalogue[recipe_id] = set(keep) | sample(
+            generator.randint(0, per_recipe // 2))
+    return catalogue
+
+
+def exact_top(index, catalogue, recipe_id):
+    """TOP рецептов с наибольшим точным коэффициентом Жаккара"""
+    size = len(catalogue[recipe_id])
+    scored = sorted(
+        (-matched / (size + missing), candidate)
+        for candidate, matched, missing
+        in index.rank(catalogue[recipe_id])
+        if candidate != recipe_id)
+    return [(candidate, -score) for score, candidate in scored[:TOP]]
+
+
+def jaccard(first, second):
+    return len(first & second) / len(first | second)
+
+
+class Command(BaseCommand):
+    help = ('Замеряет индекс похожих рецептов (MinHash/LSH) на '
+            'синтетическом каталоге без базы: построение, поиск, '
+            'обновление и качество относительно точного коэффициента '
+            'Жаккара.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=100000)
+        parser.add_argument('--ingredients', type=int, default=2000)
+        parser.add_argument('--ingredients-per-recipe', type=int,
+                            default=10)
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--updates', type=int, default=100)
+        parser.add_argument('--hashes', type=int, default=MINHASH_HASHES)
+        parser.add_argument('--band-rows', type=int,
+                            default=MINHASH_BAND_ROWS)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def timed(self, function, *args):
+        started = time.perf_counter()
+        result = function(*args)
+        return result, time.perf_counter() - started
+
+    def handle(self, *args, **options):
+        catalogue = generate(options['recipes'], options['ingredients'],
+                             options['ingredients_per_recipe'],
+                             options['seed'])
+        similarity = SimilarityIndex(catalogue, hashes=options['hashes'],
+                                     band_rows=options['band_rows'])
+        exact = IngredientIndex(catalogue)
+        _, build_time = self.timed(similarity.build, similarity.get_rows())
+        exact.build(exact.get_rows())
+        size = sum(keys.itemsize * len(keys) + ids.itemsize * len(ids)
+                   for keys, ids in similarity._bands)
+        size += sum(signature.itemsize * len(signature)
+                    for signature in similarity._signatures.values())
+        self.stdout.write(
+            f'Рецептов: {len(catalogue)}, построение: {build_time:.2f} с, '
+            f'подписи и полосы: {size / 1024 / 1024:.1f} МБ')
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'similarity.bin')
+            _, dump_time = self.timed(similarity.dump, path)
+            _, read_time = self.timed(
+                SimilarityIndex(catalogue, hashes=options['hashes'],
+                                band_rows=options['band_rows']).read, path)
+        self.stdout.write(
+            f'Запись в файл: {dump_time:.2f} с, '
+            f'загрузка воркером: {read_time:.2f} с')
+
+        generator = random.Random(options['seed'])
+        queries = generator.sample(sorted(catalogue), options['queries'])
+        timings = defaultdict(list)
+        recall, quality = [], []
+        for recipe_id in queries:
+            approximate, duration = self.timed(similarity.similar,
+                                               recipe_id, TOP)
+            timings['minhash'].append(duration)
+            best, duration = self.timed(exact_top, exact, catalogue,
+                                        recipe_id)
+            timings['exact'].append(duration)
+            if not best or not best[0][1]:
+                continue
+            found = {candidate for candidate, _ in approximate}
+            recall.append(len(found & {candidate for candidate, _ in best})
+                          / len(best))
+            quality.append(
+                sum(jaccard(catalogue[recipe_id], catalogue[candidate])
+                    for candidate in found) / len(best)
+                / (sum(score for _, score in best) / len(best)))
+
+        for name, values in timings.items():
+            self.stdout.write(
+                f'{name:<8} p50 {percentile(values, 50) * 1000:.2f} мс, '
+                f'p99 {percentile(values, 99) * 1000:.2f} мс')
+        self.stdout.write(
+            f'recall@{TOP}: {sum(recall) / len(recall):.2f}, '
+            f'средний Жаккар относительно точного топа: '
+            f'{sum(quality) / len(quality):.2f}')
+
+        changed = generator.sample(sorted(catalogue), options['updates'])
+        for recipe_id in changed:
+            catalogue[recipe_id] = set(generator.sample(
+                range(1, options['ingredients'] + 1),
+                options['ingredients_per_recipe']))
+        durations = []
+        for recipe_id in changed:
+            _, duration = self.timed(similarity.update, [recipe_id])
+            durations.append(duration)
+        _, batch = self.timed(similarity.update, changed)
+        self.stdout.write(
+            f'Обновление одного рецепта: p50 '
+            f'{percentile(durations, 50) * 1000:.2f} мс, '
+            f'{len(changed)} рецептов разом: {batch * 1000:.1f} мс')
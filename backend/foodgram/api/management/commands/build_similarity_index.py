@@ -0,0 +1,25 @@
+from core.caches import is_shared
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+
+from api.similarity import RecipeSimilarityIndex
+
+
+class Command(BaseCommand):
+    help = ('Строит MinHash-подписи и LSH-полосы индекса похожих рецептов '
+            'и записывает их в SIMILARITY_INDEX_PATH; воркеры читают файл '
+            'и догоняют журнал изменений. Запускается по расписанию.')
+
+    def handle(self, *args, **options):
+        index = RecipeSimilarityIndex()
+        # Номер берётся до чтения рецептов: изменения, сделанные во время
+        # сборки, воркеры применят повторно, это безопасно. С кешем в
+        # памяти процесса номер журнала этой команды воркерам ничего не
+        # говорит
+        sequence = index.get_sequence() if is_shared(cache) else None
+        index.build(index.get_rows())
+        index.dump(settings.SIMILARITY_INDEX_PATH, sequence)
+        self.stdout.write(self.style.SUCCESS(
+            f'Подписей рецептов: {len(index._signatures)}, файл '
+            f'{settings.SIMILARITY_INDEX_PATH}'))
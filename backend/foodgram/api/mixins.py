@@ -0,0 +1,171 @@
+import hashlib
+import time
+import uuid
+
+from core.caches import is_shared
+from core.relations import add_relations, remove_relations
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from rest_framework.response import Response
+
+from .constants import REFERENCE_CACHE_MAX_AGE, REFERENCE_CACHE_TIMEOUT
+from .serializers import BatchIdsSerializer
+
+STATE_KEY = 'response_cache:{}'
+RESPONSE_KEY = 'response_cache:{}:{}:{}'
+
+
+def get_cache_timeout(timeout):
+    """Срок хранения данных, которые инвалидируют сигналы. Кеш в памяти
+    процесса не видит инвалидацию из других воркеров, поэтому в нём
+    данные живут не дольше REFERENCE_CACHE_MAX_AGE"""
+    if is_shared(caches[DEFAULT_CACHE_ALIAS]):
+        return timeout
+    return REFERENCE_CACHE_MAX_AGE
+
+
+def get_cache_state(model):
+    """Версия и время последнего изменения данных модели"""
+    key = STATE_KEY.format(model._meta.label_lower)
+    state = cache.get(key)
+    if state is None:
+        cache.add(key, (uuid.uuid4().hex, int(time.time())),
+                  get_cache_timeout(None))
+        state = cache.get(key)
+    return state
+
+
+def invalidate_cache(model):
+    cache.set(STATE_KEY.format(model._meta.label_lower),
+              (uuid.uuid4().hex, int(time.time())), get_cache_timeout(None))
+
+
+class TimedDataMixin:
+    """Добавляет время сериализации в RequestMetrics запроса"""
+
+    @property
+    def data(self):
+        started = time.perf_counter()
+        try:
+            return super().data
+        finally:
+            self._metrics.add_timing('serializer',
+                                     time.perf_counter() - started)
+
+
+TIMED_SERIALIZER_CLASSES = {}
+
+
+def get_timed_serializer_class(serializer_class):
+    timed_class = TIMED_SERIALIZER_CLASSES.get(serializer_class)
+    if timed_class is None:
+        timed_class = type(serializer_class.__name__,
+                           (TimedDataMixin, serializer_class), {})
+        TIMED_SERIALIZER_CLASSES[serializer_class] = timed_class
+    return timed_class
+
+
+class RequestMetricsMixin:
+    """Отмечает время сериализации и рендеринга ответа для
+    RequestMetricsMiddleware.
+
+    Работает только для запросов, выбранных middleware для замера,
+    сериализация учитывается для сериализаторов из get_serializer().
+    """
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        metrics = getattr(self.request, 'metrics', None)
+        if metrics is not None:
+            serializer.__class__ = get_timed_serializer_class(
+                serializer.__class__)
+            serializer._metrics = metrics
+        return serializer
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response,
+                                             *args, **kwargs)
+        metrics = getattr(request, 'metrics', None)
+        if (metrics is not None
+                and hasattr(response, 'add_post_render_callback')):
+            started = time.perf_counter()
+            response.add_post_render_callback(
+                lambda response: metrics.add_timing(
+                    'render', time.perf_counter() - started))
+        return response
+
+
+class CachedResponseMixin:
+    """Кеширует ответы list и retrieve справочных viewset'ов.
+
+    Ответы хранятся в кеше Django по версии данных модели и адресу
+    запроса, версию меняют сигналы post_save/post_delete модели. С
+    кешем в памяти процесса версия и ответы живут не дольше
+    REFERENCE_CACHE_MAX_AGE, см. get_cache_timeout.
+    Клиентам отдаются ETag, Last-Modified и Cache-Control.
+    """
+
+    def get_cached_response(self, handler, request, *args, **kwargs):
+        model = self.get_queryset().model
+        version, last_modified = get_cache_state(model)
+        path = hashlib.sha1('{}|{}'.format(
+            request.accepted_renderer.format,
+            request.get_full_path()).encode()).hexdigest()
+        etag = f'"{version}-{path}"'
+
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified)
+        if response is None:
+            key = RESPONSE_KEY.format(model._meta.label_lower, version, path)
+            data = cache.get(key)
+            if data is None:
+                response = handler(request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+                cache.set(key, response.data,
+                          get_cache_timeout(REFERENCE_CACHE_TIMEOUT))
+            else:
+                response = Response(data)
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        patch_cache_control(response, public=True,
+                            max_age=REFERENCE_CACHE_MAX_AGE)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(super().list, request,
+                                        *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_cached_response(super().retrieve, request,
+                                        *args, **kwargs)
+
+
+class BatchRelationMixin:
+    """Пакетное добавление и удаление связей пользователя с объектами.
+
+    Объекты ищутся одним in_bulk, связи добавляются или удаляются одним
+    запросом, в ответе - статус по каждому id.
+    """
+
+    def batch_relation(self, request, model, target_model, field, add,
+                       exclude=()):
+        serializer = BatchIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = list(dict.fromkeys(serializer.validated_data['ids']))
+        found = target_model.objects.in_bulk(ids)
+        valid = [pk for pk in found if pk not in exclude]
+        statuses = {pk: 'not_found' for pk in ids}
+        statuses.update({pk: 'invalid' for pk in found if pk in exclude})
+        if add:
+            existing = add_relations(model, field, valid, user=request.user)
+            statuses.update({pk: 'exists' if pk in existing else 'added'
+                             for pk in valid})
+        else:
+            existing = remove_relations(model, field, valid,
+                                        user=request.user)
+            statuses.update({pk: 'removed' if pk in existing else 'absent'
+                             for pk in valid})
+        return Response({'results': [{'id': pk, 'status': statuses[pk]}
+                                     for pk in ids]})
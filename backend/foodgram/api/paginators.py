@@ -1,5 +1,200 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import json
+import math
+from datetime import datetime
+
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import DateTimeField, FloatField, IntegerField, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from .constants import APPROXIMATE_COUNT_THRESHOLD
+
+
+class ApproximateCountPaginator(Paginator):
+    """Для больших таблиц без фильтров берёт оценку числа строк из
+    pg_class.reltuples вместо COUNT(*)"""
+
+    @cached_property
+    def count(self):
+        query = getattr(self.object_list, 'query', None)
+        if query is not None and not query.where:
+            connection = connections[self.object_list.db]
+            if connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        'SELECT reltuples FROM pg_class WHERE relname = %s',
+                        [self.object_list.model._meta.db_table])
+                    row = cursor.fetchone()
+                if row and row[0] >= APPROXIMATE_COUNT_THRESHOLD:
+                    return int(row[0])
+        return super().count
+
+
+class KeysetPagination(BasePagination):
+    """Пагинация по ключу сортировки, например (pub_date, id).
+
+    Следующая страница выбирается условием WHERE по значениям последней
+    строки, поэтому запрос не зависит от глубины страницы и не считает
+    общее количество объектов.
+
+    С follow_queryset ключом становится сортировка самого QuerySet, если
+    она задана (например, фильтром), дополненная полями ordering, которых
+    в ней нет, чтобы ключ оставался уникальным.
+    """
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Неверный курсор.'
+
+    def __init__(self, ordering, page_size, follow_queryset=False):
+        self.ordering = ordering
+        self.page_size = page_size
+        self.follow_queryset = follow_queryset
+
+    def get_ordering(self, queryset):
+        ordering = queryset.query.order_by
+        if not self.follow_queryset or not ordering:
+            return tuple(self.ordering)
+        names = {field.lstrip('-') for field in ordering}
+        return tuple(ordering) + tuple(
+            field for field in self.ordering
+            if field.lstrip('-') not in names)
+
+    def get_fields(self, queryset):
+        """Поля модели или аннотации QuerySet для полей ключа"""
+        fields = []
+        for field in self.ordering:
+            name = field.lstrip('-')
+            annotation = queryset.query.annotations.get(name)
+            if annotation is not None:
+                fields.append(annotation.output_field)
+            else:
+                fields.append(queryset.model._meta.get_field(name))
+        return fields
+
+    def encode_cursor(self, position):
+        values = [value.isoformat() if isinstance(value, datetime) else value
+                  for value in position]
+        return base64.urlsafe_b64encode(
+            json.dumps(values).encode()).decode()
+
+    def parse_value(self, field, value):
+        """Значение из курсора с проверкой типа по полю ключа; None, если
+        значение не подходит"""
+        if isinstance(field, DateTimeField):
+            if not isinstance(value, str):
+                return None
+            try:
+                value = parse_datetime(value)
+            except ValueError:
+                return None
+            if value is None or timezone.is_naive(value):
+                return None
+            return value
+        if isinstance(value, bool):
+            return None
+        if isinstance(field, IntegerField) and isinstance(value, int):
+            return value
+        if (isinstance(field, FloatField) and isinstance(value, (int, float))
+                and math.isfinite(value)):
+            return value
+        return None
+
+    def decode_cursor(self, cursor, fields):
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(fields):
+            raise NotFound(self.invalid_cursor_message)
+        position = [self.parse_value(field, value)
+                    for field, value in zip(fields, values)]
+        if None in position:
+            raise NotFound(self.invalid_cursor_message)
+        return position
+
+    def get_keyset_filter(self, position):
+        condition = Q()
+        for index, field in enumerate(self.ordering):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            step = Q(**{f'{name}__{lookup}': position[index]})
+            for previous, value in zip(self.ordering[:index], position):
+                step &= Q(**{previous.lstrip('-'): value})
+            condition |= step
+        return condition
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering = self.get_ordering(queryset)
+        queryset = queryset.order_by(*self.ordering)
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            position = self.decode_cursor(cursor, self.get_fields(queryset))
+            queryset = queryset.filter(self.get_keyset_filter(position))
+        page = list(queryset[:self.page_size + 1])
+        self.next_position = None
+        if len(page) > self.page_size:
+            page = page[:self.page_size]
+            self.next_position = [getattr(page[-1], field.lstrip('-'))
+                                  for field in self.ordering]
+        return page
+
+    def paginate_keys(self, get_keys, request, queryset):
+        """Пагинация источника, который не выражается одним QuerySet:
+        get_keys(position, limit) возвращает значения ключа сортировки
+        не больше limit строк после position (None - с начала). По полям
+        queryset проверяются значения курсора"""
+        self.request = request
+        cursor = request.query_params.get(self.cursor_query_param)
+        position = (self.decode_cursor(cursor, self.get_fields(queryset))
+                    if cursor else None)
+        keys = get_keys(position, self.page_size + 1)
+        self.next_position = None
+        if len(keys) > self.page_size:
+            keys = keys[:self.page_size]
+            self.next_position = list(keys[-1])
+        return keys
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        url = remove_query_param(self.request.build_absolute_uri(), 'page')
+        return replace_query_param(url, self.cursor_query_param,
+                                   self.encode_cursor(self.next_position))
+
+    def get_paginated_response(self, data):
+        return Response({'next': self.get_next_link(), 'results': data})
 
 
 class CustomPagination(PageNumberPagination):
+    """Постраничная пагинация; с параметром cursor - пагинация по ключу
+    из keyset_ordering представления для текущего action. Если action
+    есть в keyset_follow_queryset представления, ключом становится
+    сортировка, заданная фильтрами"""
     page_size_query_param = 'limit'
+    django_paginator_class = ApproximateCountPaginator
+
+    def paginate_queryset(self, queryset, request, view=None):
+        ordering = getattr(view, 'keyset_ordering', {}).get(
+            getattr(view, 'action', None))
+        self.keyset = None
+        if (ordering is not None
+                and KeysetPagination.cursor_query_param
+                in request.query_params):
+            self.keyset = KeysetPagination(
+                ordering, self.get_page_size(request),
+                follow_queryset=view.action in getattr(
+                    view, 'keyset_follow_queryset', ()))
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
@@ -0,0 +1,277 @@
+import heapq
+import logging
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import Counter, defaultdict
+
+from core.caches import is_shared
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from recipes.models import RecipeIngredient
+
+from .constants import (COOK_WINDOW_MAX, RECIPE_INDEX_CHANGES_TIMEOUT,
+                        RECIPE_INDEX_LOCAL_TTL, RECIPE_INDEX_MAX_CHANGES,
+                        SHOPPING_CART_CHUNK_SIZE)
+
+logger = logging.getLogger('foodgram.recipe_index')
+
+RECIPE_INDEX_SEQUENCE_KEY = 'recipe_index:sequence'
+RECIPE_INDEX_CHANGE_KEY = 'recipe_index:change:{}'
+
+
+class ChangeLogIndex:
+    """Индекс по ингредиентам рецептов в памяти процесса.
+
+    Изменённые рецепты записываются в журнал в кеше с порядковым номером.
+    Перед поиском индекс догоняет журнал, перечитывая из базы только эти
+    рецепты, и строится заново, если журнал неполон или слишком длинный.
+    Журнал общий для всех индексов; подклассы реализуют build и update.
+
+    Кеш в памяти процесса не видит изменений из других воркеров, поэтому
+    с ним индекс строится заново не реже раза в RECIPE_INDEX_LOCAL_TTL.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._built = False
+        self._sequence = None
+        self._built_at = 0
+
+    def get_sequence(self):
+        sequence = cache.get(RECIPE_INDEX_SEQUENCE_KEY)
+        if sequence is None:
+            cache.add(RECIPE_INDEX_SEQUENCE_KEY, 0, None)
+            sequence = cache.get(RECIPE_INDEX_SEQUENCE_KEY)
+        return sequence
+
+    def mark_changed(self, recipe_id):
+        """Записывает рецепт в журнал после фиксации транзакции"""
+        def record():
+            self.get_sequence()
+            sequence = cache.incr(RECIPE_INDEX_SEQUENCE_KEY)
+            cache.set(RECIPE_INDEX_CHANGE_KEY.format(sequence), recipe_id,
+                      RECIPE_INDEX_CHANGES_TIMEOUT)
+        transaction.on_commit(record)
+
+    def get_rows(self, recipe_ids=None):
+        """Пары (id рецепта, id ингредиента) по возрастанию id рецепта"""
+        queryset = RecipeIngredient.objects.order_by('recipe_id')
+        if recipe_ids is not None:
+            queryset = queryset.filter(recipe_id__in=recipe_ids)
+        return (queryset.values_list('recipe_id', 'ingredient_id')
+                .iterator(chunk_size=SHOPPING_CART_CHUNK_SIZE))
+
+    def build(self, rows):
+        raise NotImplementedError
+
+    def update(self, recipe_ids):
+        raise NotImplementedError
+
+    def load(self, sequence):
+        """Строит индекс целиком. Возвращает номер журнала, с которым
+        индекс согласован, или None, если номер неизвестен"""
+        self.build(self.get_rows())
+        return sequence
+
+    def is_expired(self):
+        return (not is_shared(cache) and time.monotonic() - self._built_at
+                > RECIPE_INDEX_LOCAL_TTL)
+
+    def is_current(self, sequence):
+        return (self._built and sequence == self._sequence
+                and not self.is_expired())
+
+    def apply_changes(self, start, end):
+        """Обновляет рецепты из журнала с номерами start + 1 .. end.
+        Возвращает False, если журнал неполон или слишком длинный"""
+        if start is None or end is None:
+            return False
+        if start == end:
+            return True
+        if not 0 < end - start <= RECIPE_INDEX_MAX_CHANGES:
+            return False
+        keys = [RECIPE_INDEX_CHANGE_KEY.format(number)
+                for number in range(start + 1, end + 1)]
+        changes = cache.get_many(keys)
+        if len(changes) != len(keys):
+            return False
+        self.update(set(changes.values()))
+        return True
+
+    def sync(self):
+        sequence = self.get_sequence()
+        if self.is_current(sequence):
+            return
+        with self._lock:
+            if self.is_current(sequence):
+                return
+            if (not self._built or self.is_expired()
+                    or not self.apply_changes(self._sequence, sequence)):
+                loaded = self.load(sequence)
+                if (loaded is not None and loaded != sequence
+                        and not self.apply_changes(loaded, sequence)):
+                    logger.warning(
+                        '%s: журнал изменений не покрывает номера %s..%s, '
+                        'индекс отстаёт до следующей сборки',
+                        type(self).__name__, loaded, sequence)
+                self._built = True
+                self._built_at = time.monotonic()
+            self._sequence = sequence
+
+
+class RecipeIngredientIndex(ChangeLogIndex):
+    """Обратный индекс: ингредиент -> отсортированный массив id рецептов"""
+
+    def __init__(self):
+        super().__init__()
+        self._postings = None
+        self._ingredients = {}
+        self._sizes = {}
+
+    def build(self, rows):
+        postings = defaultdict(list)
+        ingredients = defaultdict(list)
+        for recipe_id, ingredient_id in rows:
+            postings[ingredient_id].append(recipe_id)
+            ingredients[recipe_id].append(ingredient_id)
+        self._postings = {ingredient_id: array('i', recipe_ids)
+                          for ingredient_id, recipe_ids in postings.items()}
+        self._ingredients = {recipe_id: frozenset(ingredient_ids)
+                             for recipe_id, ingredient_ids
+                             in ingredients.items()}
+        self._sizes = {recipe_id: len(ingredient_ids) for recipe_id,
+                       ingredient_ids in self._ingredients.items()}
+
+    def update(self, recipe_ids):
+        """Перечитывает ингредиенты рецептов и обновляет их вхождения.
+
+        Изменённые массивы заменяются копиями, чтобы параллельный поиск
+        не видел их в промежуточном состоянии.
+        """
+        current = defaultdict(set)
+        for recipe_id, ingredient_id in self.get_rows(recipe_ids):
+            current[recipe_id].add(ingredient_id)
+        for recipe_id in recipe_ids:
+            old = self._ingredients.get(recipe_id, frozenset())
+            new = frozenset(current.get(recipe_id, ()))
+            for ingredient_id in old - new:
+                posting = array('i', self._postings[ingredient_id])
+                del posting[bisect_left(posting, recipe_id)]
+                self._postings[ingredient_id] = posting
+            for ingredient_id in new - old:
+                posting = array('i', self._postings.get(ingredient_id, ()))
+                posting.insert(bisect_left(posting, recipe_id), recipe_id)
+                self._postings[ingredient_id] = posting
+            if new:
+                self._ingredients[recipe_id] = new
+                self._sizes[recipe_id] = len(new)
+            else:
+                self._ingredients.pop(recipe_id, None)
+                self._sizes.pop(recipe_id, None)
+
+    def match(self, ingredient_ids):
+        """Счётчик {id рецепта: число совпавших ингредиентов}"""
+        self.sync()
+        postings = self._postings
+        matched = Counter()
+        for ingredient_id in set(ingredient_ids):
+            matched.update(postings.get(ingredient_id, ()))
+        return matched
+
+    def top(self, matched, by_missing=False, limit=None):
+        """Первые limit рецептов из match (все, если limit не задан).
+
+        Возвращает список (id рецепта, совпало, не хватает), по умолчанию
+        по убыванию совпадений, с by_missing - по возрастанию недостающих.
+        Для страницы хватает частичной сортировки heapq.nsmallest.
+        """
+        sizes = self._sizes
+        if by_missing:
+            keys = ((sizes.get(recipe_id, count) - count, -count, -recipe_id)
+                    for recipe_id, count in matched.items())
+        else:
+            keys = ((-count, sizes.get(recipe_id, count) - count, -recipe_id)
+                    for recipe_id, count in matched.items())
+        ranking = (sorted(keys) if limit is None
+                   else heapq.nsmallest(limit, keys))
+        if by_missing:
+            return [(-recipe_id, -count, missing)
+                    for missing, count, recipe_id in ranking]
+        return [(-recipe_id, -count, missing)
+                for count, missing, recipe_id in ranking]
+
+    def rank(self, ingredient_ids, by_missing=False, limit=None):
+        """Рецепты с хотя бы одним из ингредиентов, см. top"""
+        return self.top(self.match(ingredient_ids), by_missing, limit)
+
+
+class RecipeRanking:
+    """Результат RecipeIngredientIndex для Paginator.
+
+    Срез ранжируется частично, только до нужной позиции. Фильтры списка
+    рецептов (queryset) проверяются запросом id для окна лучших
+    рецептов; если после фильтра их не хватает, окно расширяется. Окно
+    больше COOK_WINDOW_MAX не передаётся в запрос: тогда база отбирает
+    среди рецептов с этими ингредиентами подходящие под фильтры.
+    """
+
+    def __init__(self, index, ingredient_ids, by_missing=False,
+                 queryset=None):
+        self.index = index
+        self.ingredient_ids = set(ingredient_ids)
+        self.by_missing = by_missing
+        self.queryset = queryset
+        self.matched = index.match(ingredient_ids)
+        self.ranking = []
+        self.checked = 0
+
+    def get_candidates(self):
+        return self.queryset.prefetch_related(None).filter(Exists(
+            RecipeIngredient.objects.filter(
+                recipe_id=OuterRef('pk'),
+                ingredient_id__in=self.ingredient_ids)))
+
+    def count(self):
+        if self.queryset is None:
+            return len(self.matched)
+        return self.get_candidates().count()
+
+    def __len__(self):
+        return self.count()
+
+    def fill(self, size):
+        total = len(self.matched)
+        if self.queryset is None:
+            if len(self.ranking) < size:
+                self.ranking = self.index.top(self.matched, self.by_missing,
+                                              min(size, total))
+            return
+        window = size * 2
+        while len(self.ranking) < size and self.checked < total:
+            if window > COOK_WINDOW_MAX:
+                allowed = set(self.get_candidates().values_list(
+                    'id', flat=True))
+                self.ranking = [
+                    item for item in self.index.top(self.matched,
+                                                    self.by_missing)
+                    if item[0] in allowed]
+                self.checked = total
+                return
+            ranked = self.index.top(self.matched, self.by_missing, window)
+            new = ranked[self.checked:]
+            allowed = set(self.queryset.prefetch_related(None).filter(
+                id__in=[recipe_id for recipe_id, _, _ in new]).values_list(
+                    'id', flat=True))
+            self.ranking += [item for item in new if item[0] in allowed]
+            self.checked = len(ranked)
+            window *= 4
+
+    def __getitem__(self, key):
+        self.fill(len(self.matched) if key.stop is None else key.stop)
+        return self.ranking[key]
+
+
+recipe_index = RecipeIngredientIndex()
@@ -0,0 +1,67 @@
+import csv
+import json
+
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+SHOPPING_CART_FIELDS = ('name', 'measurement_unit', 'amount')
+
+
+class Echo:
+    """Псевдо-буфер для csv.writer: возвращает строку вместо записи"""
+
+    def write(self, value):
+        return value
+
+
+class ShoppingCartRenderer(BaseRenderer):
+    """Построчная выгрузка списка покупок.
+
+    stream() кодирует строки (name, measurement_unit, amount) по одной
+    для StreamingHttpResponse, render() нужен для обычных ответов API,
+    например ошибок авторизации.
+    """
+    charset = 'utf-8'
+
+    def stream(self, rows):
+        raise NotImplementedError
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if isinstance(data, dict):
+            return ''.join(f'{key}: {value}\n'
+                           for key, value in data.items()).encode(self.charset)
+        return b''.join(self.stream(data))
+
+
+class ShoppingCartTextRenderer(ShoppingCartRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def stream(self, rows):
+        for row in rows:
+            yield '{} ({}) - {}\n'.format(*row).encode(self.charset)
+
+
+class ShoppingCartCSVRenderer(ShoppingCartRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def stream(self, rows):
+        writer = csv.writer(Echo())
+        yield writer.writerow(SHOPPING_CART_FIELDS).encode(self.charset)
+        for row in rows:
+            yield writer.writerow(row).encode(self.charset)
+
+
+class ShoppingCartJSONRenderer(JSONRenderer):
+    charset = 'utf-8'
+
+    def stream(self, rows):
+        separator = '['
+        for row in rows:
+            item = json.dumps(dict(zip(SHOPPING_CART_FIELDS, row)),
+                              ensure_ascii=False)
+            yield (separator + item).encode(self.charset)
+            separator = ','
+        yield ('[]' if separator == '[' else ']').encode(self.charset)
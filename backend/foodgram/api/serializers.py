@@ -1,11 +1,18 @@
 import base64
 
 from django.core.files.base import ContentFile
-from django.db import transaction
+from django.db import router, transaction
 from djoser.serializers import UserCreateSerializer, UserSerializer
+from PIL import Image
+from recipes import shopping_lists
 from recipes.models import Ingredient, Recipe, RecipeIngredient, Tag
 from rest_framework import serializers
-from users.models import CustomUser, Subscription
+from sorl.thumbnail import default as thumbnail_default
+from users.models import CustomUser
+
+from .constants import BATCH_MAX_SIZE, RECIPE_IMAGE_MAX_DIMENSION
+from .recipe_index import recipe_index
+from .viewer import get_viewer
 
 
 class CustomUserCreateSerializer(UserCreateSerializer):
@@ -31,11 +38,9 @@ class CustomUserSerializer(UserSerializer):
                   'first_name', 'last_name', 'is_subscribed')
 
     def get_is_subscribed(self, obj):
-        if self.context['request'].user.is_anonymous:
-            return False
-        return Subscription.objects.filter(
-            user=self.context['request'].user,
-            author=obj).exists()
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
+        return obj.id in get_viewer(self.context).subscriptions
 
 
 class TagSerializer(serializers.ModelSerializer):
@@ -70,15 +75,13 @@ class CreateRecipeIngredientSerializer(serializers.ModelSerializer):
         model = RecipeIngredient
         fields = ('id', 'amount')
 
-    def to_representation(self, instance):
-        amount = RecipeIngredient.objects.get(
-            recipe__name=self.context['request'].data['name'],
-            recipe__author=self.context['request'].user,
-            ingredient=instance).amount
-        representation = {'id': instance.id, 'name': instance.name,
-                          'measurement_unit': instance.measurement_unit,
-                          'amount': amount}
-        return representation
+
+def validate_image_dimensions(width, height):
+    """Размеры берутся из заголовка файла, до декодирования пикселей"""
+    if max(width, height) > RECIPE_IMAGE_MAX_DIMENSION:
+        raise serializers.ValidationError(
+            'Изображение больше {0}x{0} пикселей.'.format(
+                RECIPE_IMAGE_MAX_DIMENSION))
 
 
 class Base64ImageField(serializers.ImageField):
@@ -87,7 +90,61 @@ class Base64ImageField(serializers.ImageField):
             format, imgstr = data.split(';base64,')
             ext = format.split('/')[-1]
             data = ContentFile(base64.b64decode(imgstr), name='temp.' + ext)
-        return super().to_internal_value(data)
+        image = super().to_internal_value(data)
+        validate_image_dimensions(*image.image.size)
+        return image
+
+
+class ImageVariantsField(serializers.ReadOnlyField):
+    """Уменьшенные копии изображения рецепта: {вариант: url и размеры}"""
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('source', 'image_variants')
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        request = self.context.get('request')
+        images = {}
+        for name, variant in value.get('variants', {}).items():
+            url = thumbnail_default.storage.url(variant['name'])
+            if request is not None:
+                url = request.build_absolute_uri(url)
+            images[name] = {'url': url, 'width': variant['width'],
+                            'height': variant['height']}
+        return images
+
+
+class RecipeImageSerializer(serializers.Serializer):
+    """Загрузка изображения рецепта файлом multipart/form-data"""
+    image = serializers.FileField()
+
+    signatures = ((b'\xff\xd8\xff', 'jpg'), (b'\x89PNG\r\n\x1a\n', 'png'),
+                  (b'GIF87a', 'gif'), (b'GIF89a', 'gif'))
+
+    def get_extension(self, header):
+        if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+            return 'webp'
+        for signature, extension in self.signatures:
+            if header.startswith(signature):
+                return extension
+        return None
+
+    def validate_image(self, image):
+        header = image.read(12)
+        image.seek(0)
+        extension = self.get_extension(header)
+        if extension is None:
+            raise serializers.ValidationError(
+                'Поддерживаются изображения JPEG, PNG, GIF и WebP.')
+        try:
+            width, height = Image.open(image).size
+        except (OSError, Image.DecompressionBombError):
+            raise serializers.ValidationError('Повреждённое изображение.')
+        finally:
+            image.seek(0)
+        validate_image_dimensions(width, height)
+        image.extension = extension
+        return image
 
 
 class RecipeSerializer(serializers.ModelSerializer):
@@ -99,48 +156,121 @@ class RecipeSerializer(serializers.ModelSerializer):
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
     image = Base64ImageField(required=False, allow_null=True)
+    images = ImageVariantsField()
 
     def get_is_favorited(self, obj):
-        user = self.context['request'].user
-        try:
-            return user.favourites.filter(recipe=obj).exists()
-        except AttributeError:
-            return False
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
+        return obj.id in get_viewer(self.context).favourites
 
     def get_is_in_shopping_cart(self, obj):
-        user = self.context['request'].user
-        try:
-            return user.list.filter(recipe=obj).exists()
-        except AttributeError:
-            return False
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
+        return obj.id in get_viewer(self.context).shopping_cart
 
     class Meta:
         model = Recipe
         fields = ('id', 'tags', 'author', 'ingredients',
                   'is_favorited', 'is_in_shopping_cart', 'name', 'image',
-                  'text', 'cooking_time')
+                  'images', 'text', 'cooking_time')
+
+
+class RecipeMatchSerializer(RecipeSerializer):
+    """Рецепт в поиске по имеющимся ингредиентам"""
+    matched_ingredients = serializers.ReadOnlyField()
+    missing_ingredients = serializers.ReadOnlyField()
+
+    class Meta(RecipeSerializer.Meta):
+        fields = RecipeSerializer.Meta.fields + ('matched_ingredients',
+                                                 'missing_ingredients')
+
+
+class RecipeSimilarSerializer(RecipeSerializer):
+    """Рецепт в списке похожих с оценкой сходства наборов ингредиентов"""
+    similarity = serializers.ReadOnlyField()
+
+    class Meta(RecipeSerializer.Meta):
+        fields = RecipeSerializer.Meta.fields + ('similarity',)
 
 
 class RecipeCreateSerializer(serializers.ModelSerializer):
     """Создание, редактирование, удаление рецепта"""
     author = CustomUserSerializer(read_only=True)
     image = Base64ImageField(required=False, allow_null=True)
-    ingredients = CreateRecipeIngredientSerializer(many=True)
+    ingredients = CreateRecipeIngredientSerializer(many=True,
+                                                   write_only=True)
 
     class Meta:
         model = Recipe
         fields = ('id', 'tags', 'author', 'ingredients', 'name', 'image',
                   'text', 'cooking_time')
 
+    def to_representation(self, instance):
+        representation = super().to_representation(instance)
+        representation['ingredients'] = RecipeIngredientSerializer(
+            RecipeIngredient.objects.filter(
+                recipe=instance).select_related('ingredient'),
+            many=True).data
+        return representation
+
     def validate_ingredients(self, data):
-        ingredients = []
+        ids = [ingredient['id'] for ingredient in data]
+        if len(ids) != len(set(ids)):
+            raise serializers.ValidationError(
+                'Нельзя указывать один ингредиент дважды.')
+        ingredients = Ingredient.objects.in_bulk(ids)
+        missing = set(ids) - ingredients.keys()
+        if missing:
+            raise serializers.ValidationError(
+                'Ингредиенты не найдены: {}.'.format(
+                    ', '.join(map(str, sorted(missing)))))
         for ingredient in data:
-            if ingredient in ingredients:
-                raise serializers.ValidationError(
-                    'Нельзя указывать один ингредиент дважды.')
-            ingredients.append(ingredient)
+            ingredient['ingredient'] = ingredients[ingredient['id']]
         return data
 
+    def create_ingredients(self, instance, ingredients):
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=instance,
+                             ingredient=ingredient['ingredient'],
+                             amount=ingredient['amount'])
+            for ingredient in ingredients)
+        recipe_index.mark_changed(instance.id)
+
+    def update_ingredients(self, instance, ingredients):
+        """Обновляет только изменившиеся ингредиенты рецепта"""
+        existing = {recipe_ingredient.ingredient_id: recipe_ingredient
+                    for recipe_ingredient in instance.ingredient.all()}
+        new = {ingredient['id']: ingredient for ingredient in ingredients}
+
+        # Удаление без сигналов: изменения списков покупок собираются
+        # в deltas и применяются один раз
+        removed = existing.keys() - new.keys()
+        deltas = {ingredient_id: -existing[ingredient_id].amount
+                  for ingredient_id in removed}
+        if removed:
+            queryset = RecipeIngredient.objects.filter(
+                recipe=instance, ingredient_id__in=removed)
+            queryset._raw_delete(router.db_for_write(RecipeIngredient))
+
+        changed = []
+        for ingredient_id in existing.keys() & new.keys():
+            recipe_ingredient = existing[ingredient_id]
+            if recipe_ingredient.amount != new[ingredient_id]['amount']:
+                deltas[ingredient_id] = (new[ingredient_id]['amount']
+                                         - recipe_ingredient.amount)
+                recipe_ingredient.amount = new[ingredient_id]['amount']
+                changed.append(recipe_ingredient)
+        if changed:
+            RecipeIngredient.objects.bulk_update(changed, ['amount'])
+
+        added = [new[ingredient_id]
+                 for ingredient_id in new.keys() - existing.keys()]
+        self.create_ingredients(instance, added)
+        deltas.update((ingredient['id'], ingredient['amount'])
+                      for ingredient in added)
+        # bulk_update и bulk_create тоже не отправляют сигналы
+        shopping_lists.change_recipe(instance.id, deltas)
+
     @transaction.atomic
     def create(self, validated_data):
         ingredients = validated_data.pop('ingredients')
@@ -148,12 +278,7 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
 
         instance = Recipe.objects.create(**validated_data)
         instance.tags.set(tags)
-        for ingredient in ingredients:
-            RecipeIngredient.objects.create(
-                recipe=instance,
-                ingredient=Ingredient.objects.get(id=ingredient['id']),
-                amount=ingredient['amount']
-            )
+        self.create_ingredients(instance, ingredients)
         return instance
 
     @transaction.atomic
@@ -167,39 +292,42 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
 
-        RecipeIngredient.objects.filter(
-            recipe=instance,
-            ingredient__in=instance.ingredients.all()).delete()
         instance.tags.set(tags)
-        for ingredient in ingredients:
-            RecipeIngredient.objects.create(
-                recipe=instance,
-                ingredient=Ingredient.objects.get(id=ingredient['id']),
-                amount=ingredient['amount']
-            )
+        self.update_ingredients(instance, ingredients)
         instance.save()
         return instance
 
 
+class BatchIdsSerializer(serializers.Serializer):
+    """Список id для пакетного добавления и удаления"""
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False, max_length=BATCH_MAX_SIZE)
+
+
 class RecipeShoppingFavouriteSerializer(serializers.ModelSerializer):
     "Добавление в список покупок и избранное"
+    images = ImageVariantsField()
+
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'images', 'cooking_time')
         extra_kwargs = {'name': {'required': False}}
 
 
 class RecipeSubscriptionsSerialiser(serializers.ModelSerializer):
     """Получение информации о рецепте в списке подписок"""
+    images = ImageVariantsField()
+
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'images', 'cooking_time')
 
 
 class SubscriptionsSerializer(serializers.ModelSerializer):
     """Получение данных о подписках пользователя"""
     is_subscribed = serializers.SerializerMethodField()
-    recipes_count = serializers.SerializerMethodField()
+    recipes_count = serializers.ReadOnlyField()
     recipes = RecipeSubscriptionsSerialiser(read_only=True, many=True)
 
     class Meta:
@@ -211,11 +339,6 @@ class SubscriptionsSerializer(serializers.ModelSerializer):
                         }
 
     def get_is_subscribed(self, obj):
-        if self.context['request'].user.is_anonymous:
-            return False
-        return Subscription.objects.filter(
-            user=self.context['request'].user,
-            author=obj).exists()
-
-    def get_recipes_count(self, obj):
-        return Recipe.objects.filter(author=obj).count()
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
+        return obj.id in get_viewer(self.context).subscriptions
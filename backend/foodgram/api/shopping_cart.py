@@ -0,0 +1,79 @@
+import hashlib
+
+from django.core.cache import cache
+from recipes.models import ShoppingListIngredient
+
+from .constants import (SHOPPING_CART_CACHE_MAX_SIZE,
+                        SHOPPING_CART_CACHE_TIMEOUT, SHOPPING_CART_CHUNK_SIZE)
+
+BODY_KEY = 'shopping_cart:user:{}:{}'
+
+
+class RowsDigest:
+    """SHA-1 строк выгрузки корзины, по мере их чтения"""
+
+    def __init__(self, format):
+        self._digest = hashlib.sha1(format.encode())
+
+    def feed(self, rows):
+        for row in rows:
+            self._digest.update('|'.join(map(str, row)).encode() + b'\n')
+            yield row
+
+    @property
+    def etag(self):
+        return '"{}"'.format(self._digest.hexdigest())
+
+
+def get_etag(user, format):
+    """Строгий ETag по содержимому корзины пользователя.
+
+    Считается по тем же строкам ShoppingListIngredient, что и выгрузка,
+    а не по версиям в кеше: итоги в базе видны всем воркерам, а сброс
+    версии в кеше памяти процесса до других воркеров не доходит.
+    """
+    digest = RowsDigest(format)
+    for _ in digest.feed(get_ingredients(user)):
+        pass
+    return digest.etag
+
+
+def get_ingredients(user):
+    """Ингредиенты корзины с суммарным количеством, через курсор.
+
+    Итоги заранее посчитаны в ShoppingListIngredient, поэтому это
+    выборка строк пользователя по индексу без агрегации. Строки
+    с нулевым итогом пропускаются.
+    """
+    return (ShoppingListIngredient.objects
+            .filter(user=user, amount__gt=0)
+            .order_by('ingredient__name', 'ingredient__measurement_unit')
+            .values_list('ingredient__name', 'ingredient__measurement_unit',
+                         'amount')
+            .iterator(chunk_size=SHOPPING_CART_CHUNK_SIZE))
+
+
+def get_cached_body(user, etag):
+    """Выгрузка из кеша; ключ - ETag, то есть содержимое корзины, поэтому
+    устаревшей она быть не может"""
+    return cache.get(BODY_KEY.format(user.id, etag))
+
+
+def stream_and_cache(user, etag, chunks, digest):
+    """Отдаёт части выгрузки и кеширует её, если она не слишком большая.
+
+    Если корзина изменилась между подсчётом etag и выгрузкой, digest
+    строк выгрузки с ним не совпадёт, и она не кешируется.
+    """
+    body, size = [], 0
+    for chunk in chunks:
+        if body is not None:
+            size += len(chunk)
+            if size > SHOPPING_CART_CACHE_MAX_SIZE:
+                body = None
+            else:
+                body.append(chunk)
+        yield chunk
+    if body is not None and digest.etag == etag:
+        cache.set(BODY_KEY.format(user.id, etag), b''.join(body),
+                  SHOPPING_CART_CACHE_TIMEOUT)
@@ -0,0 +1,55 @@
+from core.deletion import is_being_deleted
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from recipes.models import Ingredient, Recipe, RecipeIngredient, Tag
+from recipes.signals import ingredients_loaded
+from rest_framework.authtoken.models import Token
+from users.models import CustomUser
+
+from .authentication import token_cache
+from .autocomplete import ingredient_index
+from .mixins import invalidate_cache
+from .recipe_index import recipe_index
+
+
+@receiver(post_save, sender=RecipeIngredient)
+@receiver(post_delete, sender=RecipeIngredient)
+def mark_recipe_ingredients_changed(sender, instance, **kwargs):
+    if is_being_deleted(Recipe, instance.recipe_id):
+        return
+    recipe_index.mark_changed(instance.recipe_id)
+
+
+@receiver(post_delete, sender=Recipe)
+def mark_recipe_deleted(sender, instance, **kwargs):
+    recipe_index.mark_changed(instance.pk)
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+@receiver(ingredients_loaded, sender=Ingredient)
+def invalidate_ingredient_caches(sender, **kwargs):
+    ingredient_index.invalidate()
+    invalidate_cache(Ingredient)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def invalidate_tag_cache(sender, instance, **kwargs):
+    invalidate_cache(Tag)
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_token_cache(sender, instance, **kwargs):
+    transaction.on_commit(lambda: token_cache.invalidate([instance.key]))
+
+
+@receiver(post_save, sender=CustomUser)
+def invalidate_user_tokens(sender, instance, created, **kwargs):
+    if created:
+        return
+    keys = list(Token.objects.filter(user_id=instance.pk)
+                .values_list('key', flat=True))
+    if keys:
+        transaction.on_commit(lambda: token_cache.invalidate(keys))
@@ -0,0 +1,236 @@
+import heapq
+import json
+import logging
+import os
+import random
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from operator import eq
+
+from django.conf import settings
+
+from .constants import MINHASH_BAND_ROWS, MINHASH_HASHES, MINHASH_SEED
+from .recipe_index import ChangeLogIndex
+
+logger = logging.getLogger('foodgram.recipe_index')
+
+SIMILARITY_INDEX_FORMAT = 1
+
+# Простое число Мерсенна 2 ** 31 - 1: значения хешей помещаются в array('i')
+MINHASH_PRIME = (1 << 31) - 1
+
+
+class RecipeSimilarityIndex(ChangeLogIndex):
+    """MinHash-подписи наборов ингредиентов и LSH-корзины.
+
+    Подпись рецепта - MINHASH_HASHES минимумов хеш-функций по его
+    ингредиентам, доля совпавших позиций двух подписей оценивает
+    коэффициент Жаккара их наборов. Подпись делится на полосы по
+    MINHASH_BAND_ROWS значений; кандидаты в похожие - рецепты, у которых
+    совпала хотя бы одна полоса. Для каждой полосы хранятся
+    отсортированные массивы ключей и id рецептов, поиск кандидатов -
+    бинарный поиск. Изменённые рецепты переносятся копированием
+    массивов, как в RecipeIngredientIndex.
+
+    Подписи и полосы строит команда build_similarity_index и записывает
+    в SIMILARITY_INDEX_PATH; воркер читает файл и догоняет журнал
+    изменений с номера, записанного в файле. Без файла индекс строится
+    из базы.
+    """
+
+    def __init__(self, hashes=MINHASH_HASHES, band_rows=MINHASH_BAND_ROWS,
+                 seed=MINHASH_SEED):
+        super().__init__()
+        generator = random.Random(seed)
+        self.hashes = hashes
+        self.band_rows = band_rows
+        self.seed = seed
+        self._file_mtime = None
+        self._coefficients = [
+            (generator.randrange(1, MINHASH_PRIME),
+             generator.randrange(MINHASH_PRIME)) for _ in range(hashes)]
+        self._ingredient_hashes = {}
+        self._signatures = {}
+        self._bands = []
+
+    def get_ingredient_hashes(self, ingredient_id):
+        hashes = self._ingredient_hashes.get(ingredient_id)
+        if hashes is None:
+            hashes = self._ingredient_hashes[ingredient_id] = array('i', (
+                (a * ingredient_id + b) % MINHASH_PRIME
+                for a, b in self._coefficients))
+        return hashes
+
+    def get_signature(self, ingredient_ids):
+        vectors = [self.get_ingredient_hashes(ingredient_id)
+                   for ingredient_id in ingredient_ids]
+        if len(vectors) == 1:
+            return vectors[0]
+        return array('i', map(min, *vectors))
+
+    def get_band_keys(self, signature):
+        rows = self.band_rows
+        return [hash(tuple(signature[start:start + rows]))
+                for start in range(0, self.hashes, rows)]
+
+    def get_signatures(self, rows):
+        ingredients = defaultdict(list)
+        for recipe_id, ingredient_id in rows:
+            ingredients[recipe_id].append(ingredient_id)
+        return {recipe_id: self.get_signature(ingredient_ids)
+                for recipe_id, ingredient_ids in ingredients.items()}
+
+    def build(self, rows):
+        signatures = self.get_signatures(rows)
+        bands = [[] for _ in range(0, self.hashes, self.band_rows)]
+        for recipe_id, signature in signatures.items():
+            for band, key in zip(bands, self.get_band_keys(signature)):
+                band.append((key, recipe_id))
+        self._bands = []
+        for band in bands:
+            band.sort()
+            self._bands.append((array('q', (key for key, _ in band)),
+                                array('i', (pk for _, pk in band))))
+        self._signatures = signatures
+
+    def get_header(self):
+        # Ключи полос - hash() кортежей int: он не зависит от запуска
+        # процесса, но может отличаться между версиями Python
+        return {'format': SIMILARITY_INDEX_FORMAT, 'hashes': self.hashes,
+                'band_rows': self.band_rows, 'seed': self.seed,
+                'byteorder': sys.byteorder,
+                'band_hash': hash(tuple(range(self.band_rows)))}
+
+    def dump(self, path, sequence=None):
+        """Записывает подписи и полосы в файл: заголовок JSON, затем
+        массивы id рецептов, подписей и полос (array.tofile)"""
+        recipe_ids = array('i', sorted(self._signatures))
+        signatures = array('i')
+        for recipe_id in recipe_ids:
+            signatures.extend(self._signatures[recipe_id])
+        header = dict(self.get_header(), sequence=sequence,
+                      count=len(recipe_ids))
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        temporary = f'{path}.tmp'
+        with open(temporary, 'wb') as file:
+            file.write(json.dumps(header).encode() + b'\n')
+            recipe_ids.tofile(file)
+            signatures.tofile(file)
+            for keys, ids in self._bands:
+                keys.tofile(file)
+                ids.tofile(file)
+        os.replace(temporary, path)
+
+    def read(self, path):
+        """Читает файл dump; возвращает записанный в нём номер журнала"""
+        with open(path, 'rb') as file:
+            header = json.loads(file.readline())
+            count = header.pop('count')
+            sequence = header.pop('sequence')
+            if header != self.get_header():
+                raise ValueError(f'параметры индекса не совпадают: {header}')
+            recipe_ids = array('i')
+            recipe_ids.fromfile(file, count)
+            signatures = array('i')
+            signatures.fromfile(file, count * self.hashes)
+            bands = []
+            for _ in range(0, self.hashes, self.band_rows):
+                keys, ids = array('q'), array('i')
+                keys.fromfile(file, count)
+                ids.fromfile(file, count)
+                bands.append((keys, ids))
+        hashes = self.hashes
+        self._signatures = {
+            recipe_id: signatures[position * hashes:(position + 1) * hashes]
+            for position, recipe_id in enumerate(recipe_ids)}
+        self._bands = bands
+        return sequence
+
+    def load(self, sequence):
+        """Читает файл SIMILARITY_INDEX_PATH. Если файл не менялся с
+        прошлого чтения, индекс остаётся как есть и догоняет журнал"""
+        path = settings.SIMILARITY_INDEX_PATH
+        try:
+            mtime = os.stat(path).st_mtime_ns
+            if self._built and mtime == self._file_mtime:
+                return self._sequence
+            loaded = self.read(path)
+        except FileNotFoundError:
+            logger.warning('Нет файла индекса похожих рецептов %s, индекс '
+                           'строится из базы; запустите '
+                           'build_similarity_index', path)
+        except (EOFError, KeyError, ValueError) as error:
+            logger.warning('Не удалось прочитать индекс похожих рецептов '
+                           '%s (%s), индекс строится из базы', path, error)
+        else:
+            self._file_mtime = mtime
+            return loaded
+        self._file_mtime = None
+        return super().load(sequence)
+
+    def update(self, recipe_ids):
+        """Пересчитывает подписи рецептов и переносит их в полосах.
+
+        Полосы копируются один раз на всё обновление и подменяются целиком.
+        """
+        current = self.get_signatures(self.get_rows(recipe_ids))
+        changed = [recipe_id for recipe_id in recipe_ids
+                   if self._signatures.get(recipe_id)
+                   != current.get(recipe_id)]
+        if not changed:
+            return
+        bands = [(array('q', keys), array('i', ids))
+                 for keys, ids in self._bands]
+        for recipe_id in changed:
+            old = self._signatures.get(recipe_id)
+            new = current.get(recipe_id)
+            if old is not None:
+                for (keys, ids), key in zip(bands, self.get_band_keys(old)):
+                    position = self.find(keys, ids, key, recipe_id)
+                    del keys[position]
+                    del ids[position]
+            if new is not None:
+                for (keys, ids), key in zip(bands, self.get_band_keys(new)):
+                    position = self.find(keys, ids, key, recipe_id)
+                    keys.insert(position, key)
+                    ids.insert(position, recipe_id)
+                self._signatures[recipe_id] = new
+            else:
+                self._signatures.pop(recipe_id, None)
+        self._bands = bands
+
+    @staticmethod
+    def find(keys, ids, key, recipe_id):
+        """Позиция пары (key, recipe_id) в полосе, отсортированной по ключу
+        и id"""
+        start, end = bisect_left(keys, key), bisect_right(keys, key)
+        return start + bisect_left(ids[start:end], recipe_id)
+
+    def similar(self, recipe_id, limit):
+        """Не больше limit рецептов, похожих на recipe_id.
+
+        Возвращает список (id рецепта, оценка коэффициента Жаккара) по
+        убыванию оценки.
+        """
+        self.sync()
+        signatures = self._signatures
+        signature = signatures.get(recipe_id)
+        if signature is None:
+            return []
+        candidates = set()
+        for (keys, ids), key in zip(self._bands,
+                                    self.get_band_keys(signature)):
+            candidates.update(ids[bisect_left(keys, key):
+                                  bisect_right(keys, key)])
+        candidates.discard(recipe_id)
+        best = heapq.nlargest(
+            limit, ((sum(map(eq, signature, signatures[candidate])),
+                     -candidate)
+                    for candidate in candidates if candidate in signatures))
+        return [(-candidate, matched / self.hashes)
+                for matched, candidate in best]
+
+
+similarity_index = RecipeSimilarityIndex()
@@ -0,0 +1,153 @@
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TransactionTestCase, skipUnlessDBFeature
+from recipes.models import (Favourite, Ingredient, Recipe, RecipeIngredient,
+                            ShoppingList, ShoppingListIngredient, Tag)
+from rest_framework.test import APIClient, APITestCase
+from users.models import CustomUser, Subscription
+
+RECIPES = 12
+THREADS = 8
+
+
+def create_recipes(authors, count):
+    tags = [Tag.objects.create(name=f'Тег {index}', color=f'#00000{index}',
+                               slug=f'tag-{index}') for index in range(3)]
+    ingredients = [Ingredient.objects.create(name=f'Ингредиент {index}',
+                                             measurement_unit='г')
+                   for index in range(8)]
+    recipes = []
+    for index in range(count):
+        recipe = Recipe.objects.create(
+            author=authors[index % len(authors)], name=f'Рецепт {index}',
+            text='Текст', cooking_time=10)
+        recipe.tags.set(tags[:index % 3 + 1])
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe, ingredient=ingredient,
+                             amount=offset + 1)
+            for offset, ingredient in enumerate(
+                ingredients[index % 4:index % 4 + 4]))
+        recipes.append(recipe)
+    return recipes
+
+
+class RecipeListQueriesTest(APITestCase):
+    """Число запросов списка рецептов не зависит от размера страницы"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(
+            username='reader', email='reader@example.com', password='pass')
+        authors = [CustomUser.objects.create_user(
+            username=f'author{index}', email=f'author{index}@example.com',
+            password='pass') for index in range(3)]
+        recipes = create_recipes(authors, RECIPES)
+        for recipe in recipes[::2]:
+            Favourite.objects.create(user=cls.user, recipe=recipe)
+            ShoppingList.objects.create(user=cls.user, recipe=recipe)
+        Subscription.objects.create(user=cls.user, author=authors[0])
+
+    def setUp(self):
+        cache.clear()
+
+    def assert_list_queries(self, client, queries):
+        # ApproximateCountPaginator сначала читает оценку из pg_class
+        queries += connection.vendor == 'postgresql'
+        for limit in (2, RECIPES):
+            with self.subTest(limit=limit):
+                with self.assertNumQueries(queries):
+                    response = client.get('/api/recipes/',
+                                          {'limit': limit})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.data['results']), limit)
+
+    def test_anonymous(self):
+        self.assert_list_queries(self.client, 4)
+
+    def test_authenticated(self):
+        self.client.force_authenticate(self.user)
+        self.assert_list_queries(self.client, 5)
+
+
+@skipUnlessDBFeature('test_db_allows_multiple_connections')
+class ConcurrentRelationsTest(TransactionTestCase):
+    """Одновременные запросы одного пользователя к одному объекту не
+    создают дублей и не сбивают счётчики"""
+
+    def setUp(self):
+        cache.clear()
+        self.users = [CustomUser.objects.create_user(
+            username=f'user{index}', email=f'user{index}@example.com',
+            password='pass') for index in range(3)]
+        self.author = CustomUser.objects.create_user(
+            username='author', email='author@example.com', password='pass')
+        self.recipe = create_recipes([self.author], 1)[0]
+
+    def hammer(self, method, url, user):
+        def request(_):
+            try:
+                client = APIClient()
+                client.force_authenticate(user)
+                return getattr(client, method)(url).status_code
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(THREADS) as executor:
+            return sorted(executor.map(request, range(THREADS)))
+
+    def assert_hammered(self, method, url, success):
+        for user in self.users:
+            self.assertEqual(self.hammer(method, url, user),
+                             [success] + [400] * (THREADS - 1))
+
+    def assert_counters_consistent(self):
+        counters = (
+            list(Recipe.objects.values_list(
+                'favourites_count', 'in_carts_count')),
+            list(CustomUser.objects.order_by('id').values_list(
+                'recipes_count', 'subscribers_count')))
+        call_command('recount', stdout=StringIO())
+        self.assertEqual(counters, (
+            list(Recipe.objects.values_list(
+                'favourites_count', 'in_carts_count')),
+            list(CustomUser.objects.order_by('id').values_list(
+                'recipes_count', 'subscribers_count'))))
+
+    def shopping_list(self, user):
+        return dict(ShoppingListIngredient.objects.filter(
+            user=user, amount__gt=0).values_list('ingredient_id', 'amount'))
+
+    def test_add_and_remove(self):
+        recipe_urls = (f'/api/recipes/{self.recipe.id}/favorite/',
+                       f'/api/recipes/{self.recipe.id}/shopping_cart/')
+        subscribe_url = f'/api/users/{self.author.id}/subscribe/'
+        for url in recipe_urls + (subscribe_url,):
+            self.assert_hammered('post', url, 201)
+        self.recipe.refresh_from_db()
+        self.author.refresh_from_db()
+        self.assertEqual(self.recipe.favourites_count, len(self.users))
+        self.assertEqual(self.recipe.in_carts_count, len(self.users))
+        self.assertEqual(self.author.subscribers_count, len(self.users))
+        for model in (Favourite, ShoppingList):
+            self.assertEqual(model.objects.count(), len(self.users))
+        self.assertEqual(Subscription.objects.count(), len(self.users))
+        expected = dict(RecipeIngredient.objects.filter(
+            recipe=self.recipe).values_list('ingredient_id', 'amount'))
+        for user in self.users:
+            self.assertEqual(self.shopping_list(user), expected)
+        self.assert_counters_consistent()
+
+        for url in recipe_urls + (subscribe_url,):
+            self.assert_hammered('delete', url, 204)
+        self.recipe.refresh_from_db()
+        self.author.refresh_from_db()
+        self.assertEqual(self.recipe.favourites_count, 0)
+        self.assertEqual(self.recipe.in_carts_count, 0)
+        self.assertEqual(self.author.subscribers_count, 0)
+        for user in self.users:
+            self.assertEqual(self.shopping_list(user), {})
+        self.assert_counters_consistent()
@@ -0,0 +1,24 @@
+from django.core.files.uploadhandler import FileUploadHandler, StopUpload
+
+
+class MaxSizeUploadHandler(FileUploadHandler):
+    """Прерывает загрузку, как только файл превышает max_size байт.
+
+    Ставится первым в request.upload_handlers, поэтому следующие
+    обработчики (в память или во временный файл) получают данные
+    только пока ограничение не нарушено.
+    """
+
+    def __init__(self, request=None, max_size=None):
+        super().__init__(request)
+        self.max_size = max_size
+        self.exceeded = False
+
+    def receive_data_chunk(self, raw_data, start):
+        if start + len(raw_data) > self.max_size:
+            self.exceeded = True
+            raise StopUpload(connection_reset=True)
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None
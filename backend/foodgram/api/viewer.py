@@ -0,0 +1,47 @@
+from django.utils.functional import cached_property
+from recipes.models import Favourite, ShoppingList
+from users.models import Subscription
+
+
+class ViewerContext:
+    """Связи текущего пользователя, загружаемые один раз за запрос.
+
+    Каждое множество запрашивается из базы при первом обращении, после
+    чего флаги is_subscribed, is_favorited и is_in_shopping_cart
+    проверяются поиском в множестве.
+    """
+
+    def __init__(self, user):
+        self.user = user
+
+    @classmethod
+    def from_request(cls, request):
+        viewer = getattr(request, '_viewer_context', None)
+        if viewer is None:
+            viewer = cls(request.user)
+            request._viewer_context = viewer
+        return viewer
+
+    def load(self, queryset, field):
+        if self.user.is_anonymous:
+            return frozenset()
+        return frozenset(queryset.filter(user=self.user)
+                         .values_list(field, flat=True))
+
+    @cached_property
+    def subscriptions(self):
+        return self.load(Subscription.objects, 'author_id')
+
+    @cached_property
+    def favourites(self):
+        return self.load(Favourite.objects, 'recipe_id')
+
+    @cached_property
+    def shopping_cart(self):
+        return self.load(ShoppingList.objects, 'recipe_id')
+
+
+def get_viewer(context):
+    """ViewerContext из контекста сериализатора"""
+    return context.get('viewer') or ViewerContext.from_request(
+        context['request'])
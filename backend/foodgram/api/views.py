@@ -1,38 +1,71 @@
-from django.db.models import Sum
-from django.http import HttpResponse
+import uuid
+
+from core.relations import add_relation, remove_relation
+from django.db import transaction
+from django.db.models import (BooleanField, Exists, F, OuterRef, Prefetch,
+                              Subquery, Value)
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response, patch_cache_control
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.serializers import SetPasswordSerializer
+from recipes import feeds
 from recipes.models import (Favourite, Ingredient, Recipe,
-                            ShoppingList, Tag)
+                            RecipeIngredient, ShoppingList, Tag)
 from rest_framework import filters, status, viewsets
 from rest_framework.decorators import action
+from rest_framework.parsers import MultiPartParser
 from rest_framework.permissions import (AllowAny, IsAuthenticated,
                                         IsAuthenticatedOrReadOnly)
 from rest_framework.response import Response
 from users.models import CustomUser, Subscription
 
-from .constants import TRUE_FILTER
+from . import shopping_cart
+from .autocomplete import ingredient_index
+from .constants import (COOK_INGREDIENTS_PARAM, COOK_MAX_INGREDIENTS,
+                        COOK_RANK_MISSING, COOK_RANK_PARAM,
+                        INGREDIENT_SEARCH_LIMIT, INGREDIENT_SEARCH_MAX_LIMIT,
+                        INGREDIENT_SEARCH_PARAM, RECIPE_IMAGE_MAX_SIZE,
+                        RECIPES_LIMIT, SIMILAR_RECIPES_MAX, TRUE_FILTER)
 from .filters import RecipeFilter
-from .paginators import CustomPagination
+from .mixins import (BatchRelationMixin, CachedResponseMixin,
+                     RequestMetricsMixin)
+from .paginators import CustomPagination, KeysetPagination
 from .permissions import AuthorOrReadOnly
+from .recipe_index import RecipeRanking, recipe_index
+from .renderers import (ShoppingCartCSVRenderer, ShoppingCartJSONRenderer,
+                        ShoppingCartTextRenderer)
 from .serializers import (CustomUserCreateSerializer, CustomUserSerializer,
                           IngredientSerializer, RecipeCreateSerializer,
-                          RecipeSerializer, RecipeShoppingFavouriteSerializer,
+                          RecipeImageSerializer, RecipeMatchSerializer,
+                          RecipeSerializer,
+                          RecipeShoppingFavouriteSerializer,
+                          RecipeSimilarSerializer,
                           SubscriptionsSerializer, TagSerializer)
+from .similarity import similarity_index
+from .uploadhandlers import MaxSizeUploadHandler
+from .viewer import ViewerContext
 
 
-class CustomUserViewSet(viewsets.ModelViewSet):
+class CustomUserViewSet(RequestMetricsMixin, BatchRelationMixin,
+                        viewsets.ModelViewSet):
     """Получение данных о пользователях, изменение пароля"""
     queryset = CustomUser.objects.all()
     pagination_class = CustomPagination
     permission_classes = [AllowAny]
+    keyset_ordering = {
+        'subscriptions': ('-subscription_date', '-subscription_id')}
 
     def get_permissions(self):
         if self.action == 'retrieve':
             self.permission_classes = [IsAuthenticated]
         return super().get_permissions()
 
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['viewer'] = ViewerContext.from_request(self.request)
+        return context
+
     def get_serializer_class(self):
         if self.action in ('list', 'retrieve'):
             return CustomUserSerializer
@@ -60,78 +93,135 @@ class CustomUserViewSet(viewsets.ModelViewSet):
                                            context={'request': request})
         serializer.is_valid(raise_exception=True)
 
+        # request.user может быть снимком из token_cache со старыми
+        # счётчиками, поэтому сохраняется только пароль
         self.request.user.set_password(serializer.data["new_password"])
-        self.request.user.save()
+        self.request.user.save(update_fields=['password'])
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    def get_recipes_prefetch(self):
+        """Рецепты автора, не больше recipes_limit на каждого"""
+        recipes = Recipe.objects.all()
+        try:
+            recipes_limit = int(
+                self.request.query_params.get(RECIPES_LIMIT))
+        except (TypeError, ValueError):
+            recipes_limit = None
+        if recipes_limit is not None and recipes_limit >= 0:
+            recipes = recipes.filter(pk__in=Subquery(
+                Recipe.objects.filter(author=OuterRef('author'))
+                .values('pk')[:recipes_limit]))
+        return Prefetch('recipes', queryset=recipes)
+
     @action(methods=['get'], detail=False,
             permission_classes=(IsAuthenticated,))
     def subscriptions(self, request):
-        subscriptions = CustomUser.objects.filter(
-            recipe_author__user=request.user)
+        subscriptions = (
+            CustomUser.objects.filter(recipe_author__user=request.user)
+            .annotate(is_subscribed=Value(True, output_field=BooleanField()),
+                      subscription_date=F('recipe_author__subscription_date'),
+                      subscription_id=F('recipe_author__id'))
+            .order_by('username')
+            .prefetch_related(self.get_recipes_prefetch()))
         page = self.paginate_queryset(subscriptions)
         if page is not None:
-            serializer = SubscriptionsSerializer(subscriptions, many=True,
+            serializer = SubscriptionsSerializer(page, many=True,
                                                  context={'request': request})
             return self.get_paginated_response(serializer.data)
+        serializer = SubscriptionsSerializer(subscriptions, many=True,
+                                             context={'request': request})
         return Response(serializer.data, status=status.HTTP_200_OK)
 
     @action(methods=['post'], detail=True,
             permission_classes=(IsAuthenticated,))
+    @transaction.atomic
     def subscribe(self, request, *args, **kwargs):
         author = get_object_or_404(CustomUser, id=kwargs['pk'])
-        if Subscription.objects.filter(user=request.user,
-                                       author=author).exists():
+        if author == request.user:
+            return Response({'errors': 'Нельзя подписаться на себя'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if not add_relation(Subscription, user=request.user, author=author):
             return Response({'errors': 'Подписка уже оформлена'},
                             status=status.HTTP_400_BAD_REQUEST)
-        serializer = SubscriptionsSerializer(author, data=request.data,
+        author.is_subscribed = True
+        serializer = SubscriptionsSerializer(author,
                                              context={'request': request})
-        if serializer.is_valid():
-            Subscription.objects.create(user=request.user, author=author)
-            return Response(serializer.data,
-                            status=status.HTTP_201_CREATED)
-        return Response(serializer.errors,
-                        status=status.HTTP_400_BAD_REQUEST)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     @subscribe.mapping.delete
+    @transaction.atomic
     def delete_subscribe(self, request, *args, **kwargs):
-        author = get_object_or_404(CustomUser, id=kwargs['pk'])
-        if Subscription.objects.filter(user=request.user,
-                                       author=author).exists():
-            Subscription.objects.filter(user=request.user,
-                                        author=author).delete()
+        if remove_relation(Subscription, user=request.user,
+                           author_id=kwargs['pk']):
             return Response(status=status.HTTP_204_NO_CONTENT)
+        get_object_or_404(CustomUser, id=kwargs['pk'])
         return Response({'errors': 'Вы не подписаны на этого автора'},
                         status=status.HTTP_400_BAD_REQUEST)
 
+    @action(methods=['post'], detail=False, url_path='subscribe/batch',
+            permission_classes=(IsAuthenticated,))
+    @transaction.atomic
+    def batch_subscribe(self, request):
+        return self.batch_relation(request, Subscription, CustomUser,
+                                   'author_id', add=True,
+                                   exclude=(request.user.id,))
+
+    @batch_subscribe.mapping.delete
+    @transaction.atomic
+    def batch_delete_subscribe(self, request):
+        return self.batch_relation(request, Subscription, CustomUser,
+                                   'author_id', add=False)
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+
+class TagViewSet(RequestMetricsMixin, CachedResponseMixin,
+                 viewsets.ReadOnlyModelViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     permission_classes = [AllowAny]
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(RequestMetricsMixin, BatchRelationMixin,
+                    viewsets.ModelViewSet):
     queryset = Recipe.objects.all()
     serializer_class = RecipeSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
     pagination_class = CustomPagination
     filter_backends = (DjangoFilterBackend, )
     filterset_class = RecipeFilter
+    keyset_ordering = {'list': ('-pub_date', '-id'),
+                       'feed': ('-pub_date', '-id')}
+    # ordering=popular, ordering=trending и поиск по релевантности
+    # задают свою сортировку, курсор строится по ней
+    keyset_follow_queryset = ('list',)
 
     def get_queryset(self):
-        queryset = Recipe.objects.all()
-        if self.request.user.is_anonymous:
+        user = self.request.user
+        queryset = Recipe.objects.select_related('author').prefetch_related(
+            'tags',
+            Prefetch('ingredient',
+                     queryset=RecipeIngredient.objects.select_related(
+                         'ingredient')))
+        if user.is_anonymous:
             return queryset
+        queryset = queryset.annotate(
+            is_favorited=Exists(Favourite.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+            is_in_shopping_cart=Exists(ShoppingList.objects.filter(
+                user=user, recipe=OuterRef('pk'))))
         is_favorited = self.request.query_params.get('is_favorited')
         is_in_shopping_cart = self.request.query_params.get(
             'is_in_shopping_cart')
         if is_favorited == TRUE_FILTER:
-            queryset = queryset.filter(favourites__user=self.request.user)
+            queryset = queryset.filter(is_favorited=True)
         if is_in_shopping_cart == TRUE_FILTER:
-            queryset = queryset.filter(list__user=self.request.user)
+            queryset = queryset.filter(is_in_shopping_cart=True)
         return queryset
 
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['viewer'] = ViewerContext.from_request(self.request)
+        return context
+
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
@@ -139,8 +229,12 @@ class RecipeViewSet(viewsets.ModelViewSet):
         serializer.save(author=self.request.user)
 
     def get_serializer_class(self):
-        if self.action in ('list', 'retrieve'):
+        if self.action in ('list', 'retrieve', 'feed'):
             return RecipeSerializer
+        elif self.action == 'cook':
+            return RecipeMatchSerializer
+        elif self.action == 'similar':
+            return RecipeSimilarSerializer
         else:
             return RecipeCreateSerializer
 
@@ -149,86 +243,251 @@ class RecipeViewSet(viewsets.ModelViewSet):
             self.permission_classes = [AuthorOrReadOnly]
         return super().get_permissions()
 
+    @action(methods=['get'], detail=False)
+    def cook(self, request):
+        """Рецепты из имеющихся ингредиентов.
+
+        По умолчанию сортирует по числу совпавших ингредиентов,
+        с rank=missing - по числу недостающих. Фильтры списка рецептов
+        проверяются только для лучших по рангу рецептов, см.
+        RecipeRanking; рецепты загружаются только для текущей страницы.
+        """
+        try:
+            ingredient_ids = {
+                int(value)
+                for values in request.query_params.getlist(
+                    COOK_INGREDIENTS_PARAM)
+                for value in values.split(',') if value.strip()}
+        except ValueError:
+            return Response({'errors': 'id ингредиентов должны быть числами'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if not ingredient_ids:
+            return Response({'errors': 'Укажите хотя бы один ингредиент'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if len(ingredient_ids) > COOK_MAX_INGREDIENTS:
+            return Response(
+                {'errors': 'Можно указать не больше {} ингредиентов'.format(
+                    COOK_MAX_INGREDIENTS)},
+                status=status.HTTP_400_BAD_REQUEST)
+
+        queryset = self.filter_queryset(self.get_queryset())
+        ranking = RecipeRanking(
+            recipe_index, ingredient_ids,
+            by_missing=request.query_params.get(
+                COOK_RANK_PARAM) == COOK_RANK_MISSING,
+            queryset=queryset if queryset.query.has_filters() else None)
+        page = self.paginate_queryset(ranking)
+        if page is None:
+            page = ranking[:]
+        recipes = self.get_queryset().in_bulk(
+            [recipe_id for recipe_id, _, _ in page])
+        result = []
+        for recipe_id, matched, missing in page:
+            recipe = recipes.get(recipe_id)
+            if recipe is not None:
+                recipe.matched_ingredients = matched
+                recipe.missing_ingredients = missing
+                result.append(recipe)
+        serializer = self.get_serializer(result, many=True)
+        if self.paginator is not None:
+            return self.get_paginated_response(serializer.data)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+    @action(methods=['get'], detail=True)
+    def similar(self, request, *args, **kwargs):
+        """Рецепты с самым похожим набором ингредиентов.
+
+        Кандидаты и оценка коэффициента Жаккара берутся из MinHash/LSH
+        индекса в памяти, рецепты загружаются только для текущей страницы.
+        """
+        recipe = get_object_or_404(Recipe, id=kwargs['pk'])
+        ranking = similarity_index.similar(recipe.id, SIMILAR_RECIPES_MAX)
+        page = self.paginate_queryset(ranking)
+        if page is None:
+            page = ranking
+        recipes = self.get_queryset().in_bulk(
+            [recipe_id for recipe_id, _ in page])
+        result = []
+        for recipe_id, similarity in page:
+            recipe = recipes.get(recipe_id)
+            if recipe is not None:
+                recipe.similarity = round(similarity, 2)
+                result.append(recipe)
+        serializer = self.get_serializer(result, many=True)
+        if self.paginator is not None:
+            return self.get_paginated_response(serializer.data)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+    @action(methods=['get'], detail=False,
+            permission_classes=(IsAuthenticated,))
+    def feed(self, request):
+        """Рецепты авторов из подписок, новые сначала.
+
+        Пагинация только по ключу (pub_date, id), следующая страница - по
+        ссылке next. Ключи страницы выбирает recipes.feeds способом из
+        FEED_STRATEGY, рецепты загружаются только для текущей страницы.
+        """
+        paginator = KeysetPagination(self.keyset_ordering['feed'],
+                                     self.paginator.get_page_size(request))
+        queryset = self.get_queryset()
+        keys = paginator.paginate_keys(
+            lambda position, limit: feeds.get_keys(request.user, position,
+                                                   limit),
+            request, queryset)
+        recipes = queryset.in_bulk(
+            [recipe_id for _, recipe_id in keys])
+        serializer = self.get_serializer(
+            [recipes[recipe_id] for _, recipe_id in keys
+             if recipe_id in recipes], many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(methods=['put'], detail=True,
+            permission_classes=(IsAuthenticated, AuthorOrReadOnly),
+            parser_classes=(MultiPartParser,))
+    def image(self, request, *args, **kwargs):
+        """Загрузка изображения файлом, без base64 в JSON"""
+        recipe = get_object_or_404(Recipe, id=kwargs['pk'])
+        self.check_object_permissions(request, recipe)
+        too_large = Response(
+            {'errors': 'Размер файла превышает {} МБ'.format(
+                RECIPE_IMAGE_MAX_SIZE // (1024 * 1024))},
+            status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        try:
+            content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            content_length = 0
+        if content_length > RECIPE_IMAGE_MAX_SIZE + 64 * 1024:
+            return too_large
+        size_limit = MaxSizeUploadHandler(request._request,
+                                          RECIPE_IMAGE_MAX_SIZE)
+        request.upload_handlers.insert(0, size_limit)
+
+        serializer = RecipeImageSerializer(data=request.data)
+        if size_limit.exceeded:
+            return too_large
+        serializer.is_valid(raise_exception=True)
+        image = serializer.validated_data['image']
+        recipe.image.save(f'{uuid.uuid4().hex}.{image.extension}', image)
+        serializer = RecipeShoppingFavouriteSerializer(
+            recipe, context={'request': request})
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
     @action(methods=['post'], detail=True,
             permission_classes=(IsAuthenticated,)
             )
+    @transaction.atomic
     def shopping_cart(self, request, *args, **kwargs):
         recipe = get_object_or_404(Recipe, id=kwargs['pk'])
-        if ShoppingList.objects.filter(recipe=recipe,
-                                       user=request.user).exists():
+        if not add_relation(ShoppingList, recipe=recipe, user=request.user):
             return Response(
                 {'errors': 'Рецепт уже добавлен в список покупок'},
                 status=status.HTTP_400_BAD_REQUEST)
         serializer = RecipeShoppingFavouriteSerializer(
-            recipe, data=request.data, context={'request': request})
-        if serializer.is_valid():
-            ShoppingList.objects.create(recipe=recipe, user=request.user)
-            return Response(serializer.data,
-                            status=status.HTTP_201_CREATED)
-        return Response(serializer.errors,
-                        status=status.HTTP_400_BAD_REQUEST)
+            recipe, context={'request': request})
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     @shopping_cart.mapping.delete
+    @transaction.atomic
     def delete_shopping_cart(self, request, *args, **kwargs):
-        recipe = get_object_or_404(Recipe, id=kwargs['pk'])
-        if ShoppingList.objects.filter(recipe=recipe,
-                                       user=request.user).exists():
-            ShoppingList.objects.filter(recipe=recipe,
-                                        user=request.user).delete()
+        if remove_relation(ShoppingList, recipe_id=kwargs['pk'],
+                           user=request.user):
             return Response(status=status.HTTP_204_NO_CONTENT)
+        get_object_or_404(Recipe, id=kwargs['pk'])
         return Response({'errors': 'Объекта не существует'},
                         status=status.HTTP_400_BAD_REQUEST)
 
-    @action(methods=['get'], detail=False,
+    @action(methods=['post'], detail=False, url_path='shopping_cart/batch',
             permission_classes=(IsAuthenticated,))
+    @transaction.atomic
+    def batch_shopping_cart(self, request):
+        return self.batch_relation(request, ShoppingList, Recipe,
+                                   'recipe_id', add=True)
+
+    @batch_shopping_cart.mapping.delete
+    @transaction.atomic
+    def batch_delete_shopping_cart(self, request):
+        return self.batch_relation(request, ShoppingList, Recipe,
+                                   'recipe_id', add=False)
+
+    @action(methods=['get'], detail=False,
+            permission_classes=(IsAuthenticated,),
+            renderer_classes=(ShoppingCartTextRenderer,
+                              ShoppingCartCSVRenderer,
+                              ShoppingCartJSONRenderer))
     def download_shopping_cart(self, request):
-        ingredients = (Ingredient.objects
-                       .filter(recipe__recipe__list__user=request.user)
-                       .values('name').annotate(total=Sum('recipe__amount'))
-                       .values_list('name', 'measurement_unit', 'total'))
-
-        data = []
-        for ingredient in ingredients:
-            data.append('{} ({}) - {}'.format(*ingredient))
-
-        response = HttpResponse('\n'.join(data),
-                                content_type='text/plain; charset=UTF-8')
-        response['Content-Disposition'] = (
-            f'attachment; filename={"Список покупок"}')
+        renderer = request.accepted_renderer
+        etag = shopping_cart.get_etag(request.user, renderer.format)
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            body = shopping_cart.get_cached_body(request.user, etag)
+            content_type = f'{renderer.media_type}; charset={renderer.charset}'
+            if body is not None:
+                response = HttpResponse(body, content_type=content_type)
+            else:
+                digest = shopping_cart.RowsDigest(renderer.format)
+                response = StreamingHttpResponse(
+                    shopping_cart.stream_and_cache(
+                        request.user, etag, renderer.stream(digest.feed(
+                            shopping_cart.get_ingredients(request.user))),
+                        digest),
+                    content_type=content_type)
+            response['Content-Disposition'] = (
+                f'attachment; filename=shopping_list.{renderer.format}')
+        response['ETag'] = etag
+        patch_cache_control(response, private=True, no_cache=True)
         return response
 
     @action(methods=['post'], detail=True,
             permission_classes=(IsAuthenticated,))
+    @transaction.atomic
     def favorite(self, request, *args, **kwargs):
         recipe = get_object_or_404(Recipe, id=kwargs['pk'])
-        if Favourite.objects.filter(recipe=recipe,
-                                    user=request.user).exists():
+        if not add_relation(Favourite, recipe=recipe, user=request.user):
             return Response({'errors': 'Рецепт уже добавлен в избранное'},
                             status=status.HTTP_400_BAD_REQUEST)
         serializer = RecipeShoppingFavouriteSerializer(
-            recipe, data=request.data, context={'request': request})
-        if serializer.is_valid():
-            Favourite.objects.create(recipe=recipe, user=request.user)
-            return Response(serializer.data,
-                            status=status.HTTP_201_CREATED)
-        return Response(serializer.errors,
-                        status=status.HTTP_400_BAD_REQUEST)
+            recipe, context={'request': request})
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     @favorite.mapping.delete
+    @transaction.atomic
     def delete_favorite(self, request, *args, **kwargs):
-        recipe = get_object_or_404(Recipe, id=kwargs['pk'])
-        if Favourite.objects.filter(recipe=recipe,
-                                    user=request.user).exists():
-            Favourite.objects.filter(recipe=recipe,
-                                     user=request.user).delete()
+        if remove_relation(Favourite, recipe_id=kwargs['pk'],
+                           user=request.user):
             return Response(status=status.HTTP_204_NO_CONTENT)
+        get_object_or_404(Recipe, id=kwargs['pk'])
         return Response({'errors': 'Объекта не существует'},
                         status=status.HTTP_400_BAD_REQUEST)
 
+    @action(methods=['post'], detail=False, url_path='favorite/batch',
+            permission_classes=(IsAuthenticated,))
+    @transaction.atomic
+    def batch_favorite(self, request):
+        return self.batch_relation(request, Favourite, Recipe, 'recipe_id',
+                                   add=True)
+
+    @batch_favorite.mapping.delete
+    @transaction.atomic
+    def batch_delete_favorite(self, request):
+        return self.batch_relation(request, Favourite, Recipe, 'recipe_id',
+                                   add=False)
+
 
-class IgredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IgredientViewSet(RequestMetricsMixin, CachedResponseMixin,
+                       viewsets.ReadOnlyModelViewSet):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     permission_classes = [AllowAny]
     filter_backends = (filters.SearchFilter, )
     search_fields = ('^name',)
+
+    def list(self, request, *args, **kwargs):
+        name = request.query_params.get(INGREDIENT_SEARCH_PARAM)
+        if name is None:
+            return super().list(request, *args, **kwargs)
+        try:
+            limit = min(int(request.query_params.get('limit')),
+                        INGREDIENT_SEARCH_MAX_LIMIT)
+        except (TypeError, ValueError):
+            limit = INGREDIENT_SEARCH_LIMIT
+        return Response(ingredient_index.search(name, max(limit, 0)))
@@ -0,0 +1,15 @@
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.utils.connection import ConnectionProxy
+
+# Бэкенды, данные которых не видны другим процессам: запись или
+# инвалидация в одном воркере до остальных не доходит
+PROCESS_LOCAL_BACKENDS = (LocMemCache, DummyCache)
+
+
+def is_shared(cache):
+    """Кеш общий для всех процессов (Redis, Memcached, база и т.п.).
+    Принимает и бэкенд, и django.core.cache.cache"""
+    if isinstance(cache, ConnectionProxy):
+        cache = cache._connections[cache._alias]
+    return not isinstance(cache, PROCESS_LOCAL_BACKENDS)
@@ -0,0 +1,77 @@
+from collections import defaultdict
+
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+from django.db.models.signals import post_delete, post_save
+
+from .deletion import is_being_deleted, track_deletion
+
+COUNTERS = defaultdict(list)
+
+
+class CounterFieldsMixin:
+    """Модель с денормализованными счётчиками counter_fields.
+
+    Счётчики меняются только UPDATE с F()-выражениями, поэтому обычный
+    save() существующего объекта их не записывает: иначе значение,
+    прочитанное при загрузке, затёрло бы параллельные изменения.
+    Явно переданный update_fields не меняется.
+    """
+    counter_fields = ()
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.attname for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.attname not in deferred
+                and field.name not in self.counter_fields]
+        super().save(*args, **kwargs)
+
+
+def connect_counter(sender, model, field, counter):
+    """Поддерживает денормализованный счётчик записей sender.
+
+    При создании и удалении записи sender поле counter объекта model,
+    на который указывает field, меняется одним UPDATE с F()-выражением
+    в той же транзакции, что и сама запись. При каскадном удалении
+    самого объекта model счётчик не трогается.
+    """
+
+    def increment(sender, instance, created, raw=False, **kwargs):
+        if created and not raw:
+            model.objects.filter(pk=getattr(instance, field)).update(
+                **{counter: F(counter) + 1})
+
+    def decrement(sender, instance, **kwargs):
+        pk = getattr(instance, field)
+        if is_being_deleted(model, pk):
+            return
+        model.objects.filter(pk=pk).update(
+            **{counter: Greatest(F(counter) - 1, 0)})
+
+    COUNTERS[sender].append((model, field, counter))
+    track_deletion(model)
+    dispatch_uid = f'{sender._meta.label}.{counter}'
+    post_save.connect(increment, sender=sender, weak=False,
+                      dispatch_uid=dispatch_uid)
+    post_delete.connect(decrement, sender=sender, weak=False,
+                        dispatch_uid=dispatch_uid)
+
+
+def count_subquery(sender, field):
+    """Подзапрос с числом записей sender, ссылающихся через field на
+    текущую строку; используется для пересчёта счётчиков"""
+    return Coalesce(Subquery(
+        sender.objects.filter(**{field: OuterRef('pk')})
+        .order_by().values(field).annotate(count=Count('pk'))
+        .values('count'), output_field=IntegerField()), 0)
+
+
+def refresh_counters(sender, pks):
+    """Пересчитывает счётчики sender у объектов pks, по одному UPDATE
+    на счётчик; нужен после массовых операций без сигналов"""
+    for model, field, counter in COUNTERS[sender]:
+        model.objects.filter(pk__in=pks).update(
+            **{counter: count_subquery(sender, field)})
@@ -0,0 +1,35 @@
+import threading
+
+from django.db.models.signals import post_delete, pre_delete
+
+_local = threading.local()
+
+
+def get_deleting():
+    if not hasattr(_local, 'keys'):
+        _local.keys = set()
+    return _local.keys
+
+
+def is_being_deleted(model, pk):
+    """Объект model с pk удаляется в текущем потоке, и post_delete
+    приходит от каскадного удаления связанных с ним строк"""
+    return (model._meta.label, pk) in get_deleting()
+
+
+def track_deletion(model):
+    """Отмечает объекты model на время удаления, от pre_delete до
+    post_delete, чтобы построчные обработчики каскада могли пропустить
+    работу, которую обработчик самого объекта делает один раз"""
+
+    def started(sender, instance, **kwargs):
+        get_deleting().add((model._meta.label, instance.pk))
+
+    def finished(sender, instance, **kwargs):
+        get_deleting().discard((model._meta.label, instance.pk))
+
+    dispatch_uid = f'{model._meta.label}.deletion'
+    pre_delete.connect(started, sender=model, weak=False,
+                       dispatch_uid=dispatch_uid)
+    post_delete.connect(finished, sender=model, weak=False,
+                        dispatch_uid=dispatch_uid)
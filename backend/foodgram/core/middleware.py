@@ -0,0 +1,102 @@
+import logging
+import random
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger('foodgram.metrics')
+
+
+class RequestMetrics:
+    """Счётчики одного запроса: SQL-запросы, время в базе и этапы
+    обработки, которые отмечает представление (serializer, render)"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.templates = Counter()
+        self.timings = Counter()
+        self.view = None
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.queries += 1
+            self.templates[sql] += 1
+
+    def add_timing(self, name, duration):
+        self.timings[name] += duration
+
+    def get_repeated_queries(self, threshold):
+        return [(sql, count) for sql, count in self.templates.most_common()
+                if count >= threshold]
+
+
+class RequestMetricsMiddleware:
+    """Замеряет часть запросов к API и отдаёт результаты в заголовке
+    Server-Timing и в логе foodgram.metrics.
+
+    Доля замеряемых запросов задаётся REQUEST_METRICS_SAMPLE_RATE.
+    Шаблоны SQL, повторившиеся не меньше
+    REQUEST_METRICS_REPEATED_QUERIES раз, считаются вероятным N+1.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if (not request.path.startswith(settings.REQUEST_METRICS_PATH)
+                or random.random() >= settings.REQUEST_METRICS_SAMPLE_RATE):
+            return self.get_response(request)
+
+        metrics = request.metrics = RequestMetrics()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(metrics))
+            response = self.get_response(request)
+        total = time.perf_counter() - metrics.started
+
+        timings = [('db', metrics.db_time, f'{metrics.queries} queries')]
+        timings += [(name, duration, None)
+                    for name, duration in metrics.timings.items()]
+        timings.append(('total', total, None))
+        response['Server-Timing'] = ', '.join(
+            f'{name};dur={duration * 1000:.1f}'
+            + (f';desc="{description}"' if description else '')
+            for name, duration, description in timings)
+
+        logger.info(
+            'method=%s path=%s view=%s status=%s queries=%s %s',
+            request.method, request.path, metrics.view,
+            response.status_code, metrics.queries,
+            ' '.join(f'{name}_ms={duration * 1000:.1f}'
+                     for name, duration, _ in timings),
+            extra={'metrics': {
+                'method': request.method,
+                'path': request.path,
+                'view': metrics.view,
+                'status': response.status_code,
+                'queries': metrics.queries,
+                **{f'{name}_ms': round(duration * 1000, 1)
+                   for name, duration, _ in timings}}})
+        for sql, count in metrics.get_repeated_queries(
+                settings.REQUEST_METRICS_REPEATED_QUERIES):
+            logger.warning('Вероятный N+1 в %s: %s одинаковых запросов: %s',
+                           metrics.view, count, sql)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        metrics = getattr(request, 'metrics', None)
+        if metrics is not None:
+            view = getattr(view_func, 'cls', view_func)
+            metrics.view = f'{view.__module__}.{view.__qualname__}'
+            actions = getattr(view_func, 'actions', None)
+            if actions and request.method.lower() in actions:
+                metrics.view += f'.{actions[request.method.lower()]}'
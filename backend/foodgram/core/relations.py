@@ -0,0 +1,127 @@
+from django.db import connections, router
+from django.db.models import sql
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import Signal
+
+from .counters import refresh_counters
+
+# Отправляются после массовых операций со связями в обход post_save и
+# post_delete; instances - добавленные или удалённые связи
+relations_added = Signal()
+relations_removed = Signal()
+
+
+def insert_ignoring_conflicts(model, instances, using, returning=None):
+    """INSERT ... ON CONFLICT DO NOTHING, как у
+    bulk_create(ignore_conflicts=True). Возвращает число вставленных
+    строк и значения поля returning у них (только PostgreSQL)"""
+    query = sql.InsertQuery(model, ignore_conflicts=True)
+    query.insert_values(
+        [field for field in model._meta.local_concrete_fields
+         if not field.primary_key], instances)
+    compiler = query.get_compiler(using)
+    if returning is not None:
+        compiler.returning_fields = [model._meta.get_field(returning)]
+    with connections[using].cursor() as cursor:
+        for statement, params in compiler.as_sql():
+            cursor.execute(statement, params)
+        values = ([row[0] for row in cursor.fetchall()]
+                  if returning is not None else [])
+        return cursor.rowcount, values
+
+
+def add_relation(model, **fields):
+    """Добавляет связь одним INSERT ... ON CONFLICT DO NOTHING.
+
+    Возвращает False, если такая строка уже есть, в том числе вставленная
+    параллельным запросом. Запрос тот же, что у
+    bulk_create(ignore_conflicts=True), но с числом добавленных строк.
+    post_save отправляется вручную, чтобы обновлялись счётчики.
+    """
+    instance = model(**fields)
+    using = router.db_for_write(model)
+    inserted = insert_ignoring_conflicts(model, [instance], using)[0] > 0
+    if inserted:
+        instance._state.adding = False
+        instance._state.db = using
+        post_save.send(sender=model, instance=instance, created=True,
+                       update_fields=None, raw=False, using=using)
+    return inserted
+
+
+def remove_relation(model, **fields):
+    """Удаляет связь одним DELETE и возвращает число удалённых строк.
+
+    post_delete отправляется вручную для экземпляра из fields.
+    """
+    using = router.db_for_write(model)
+    deleted = model.objects.filter(**fields)._raw_delete(using)
+    if deleted:
+        instance = model(**fields)
+        post_delete.send(sender=model, instance=instance, using=using)
+    return deleted
+
+
+def supports_returning(using):
+    return connections[using].vendor == 'postgresql'
+
+
+def add_relations(model, field, ids, **fields):
+    """Добавляет связи с объектами ids и пересчитывает счётчики.
+    Возвращает множество id, связи с которыми уже были.
+
+    На PostgreSQL - один INSERT ... ON CONFLICT DO NOTHING RETURNING,
+    на других СУБД - INSERT на каждую связь с проверкой числа строк.
+    relations_added отправляется только для строк, вставленных этим
+    вызовом, а не параллельным запросом.
+    """
+    using = router.db_for_write(model)
+    # Одинаковый порядок строк у параллельных вставок: иначе они ждут
+    # уникальные ключи друг друга в разном порядке и попадают в deadlock
+    instances = [model(**fields, **{field: pk}) for pk in sorted(set(ids))]
+    if not instances:
+        return set()
+    if supports_returning(using):
+        added = set(insert_ignoring_conflicts(model, instances, using,
+                                              returning=field)[1])
+    else:
+        added = {getattr(instance, field) for instance in instances
+                 if insert_ignoring_conflicts(model, [instance], using)[0]}
+    if added:
+        refresh_counters(model, added)
+        relations_added.send(
+            sender=model,
+            instances=[instance for instance in instances
+                       if getattr(instance, field) in added])
+    return set(ids) - added
+
+
+def remove_relations(model, field, ids, **fields):
+    """Удаляет связи с объектами ids и пересчитывает счётчики.
+    Возвращает множество id, связи с которыми были удалены.
+
+    На PostgreSQL - один DELETE ... RETURNING, на других СУБД - DELETE
+    на каждую связь с проверкой числа строк. relations_removed
+    отправляется только для строк, удалённых этим вызовом.
+    """
+    using = router.db_for_write(model)
+    if supports_returning(using):
+        query = model.objects.filter(
+            **fields, **{f'{field}__in': ids}).query.clone()
+        query.__class__ = sql.DeleteQuery
+        statement, params = query.get_compiler(using).as_sql()
+        column = connections[using].ops.quote_name(
+            model._meta.get_field(field).column)
+        with connections[using].cursor() as cursor:
+            cursor.execute(f'{statement} RETURNING {column}', params)
+            removed = {row[0] for row in cursor.fetchall()}
+    else:
+        removed = {pk for pk in ids
+                   if model.objects.filter(
+                       **fields, **{field: pk})._raw_delete(using)}
+    if removed:
+        refresh_counters(model, removed)
+        relations_removed.send(
+            sender=model,
+            instances=[model(**fields, **{field: pk}) for pk in removed])
+    return removed
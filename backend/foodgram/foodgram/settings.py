@@ -32,6 +32,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -66,7 +67,7 @@ SILENCED_SYSTEM_CHECKS = ['rest_framework.W001']
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        'ENGINE': os.getenv('DB_ENGINE', 'django.db.backends.postgresql'),
         'NAME': os.getenv('DB_NAME'),
         'USER': os.getenv('POSTGRES_USER'),
         'PASSWORD': os.getenv('POSTGRES_PASSWORD'),
@@ -75,6 +76,14 @@ DATABASES = {
     }
 }
 
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND',
+                             'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'foodgram'),
+    }
+}
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': ('django.contrib.auth.password_validation'
@@ -114,6 +123,54 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+THUMBNAIL_QUALITY = 80
+
+THUMBNAIL_ENGINE = 'recipes.images.Engine'
+
+RECIPE_IMAGE_FORMAT = 'WEBP'
+
+# Больше варианты не создаются; через API такие файлы не загрузить,
+# см. RECIPE_IMAGE_MAX_DIMENSION
+RECIPE_IMAGE_MAX_PIXELS = 8000 * 8000
+
+RECIPE_IMAGE_VARIANTS = {
+    'thumbnail': ('150x150', {'crop': 'center'}),
+    'card': ('600x400', {'crop': 'center'}),
+    'full': ('1200', {'upscale': False}),
+}
+
+# Файл подписей индекса похожих рецептов, см. build_similarity_index
+SIMILARITY_INDEX_PATH = os.getenv(
+    'SIMILARITY_INDEX_PATH', os.path.join(BASE_DIR, 'index', 'similarity.bin'))
+
+AUTH_TOKEN_CACHE = os.getenv('AUTH_TOKEN_CACHE', 'default')
+
+REQUEST_METRICS_PATH = '/api/'
+
+REQUEST_METRICS_SAMPLE_RATE = float(
+    os.getenv('REQUEST_METRICS_SAMPLE_RATE', '0.1'))
+
+REQUEST_METRICS_REPEATED_QUERIES = 10
+
+# Лента подписок: merge - собирается при чтении из последних рецептов
+# каждого автора, inbox - рецепты раскладываются по лентам подписчиков
+# при публикации (после переключения нужна команда rebuild_feeds)
+FEED_STRATEGY = os.getenv('FEED_STRATEGY', 'merge')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'foodgram.metrics': {'handlers': ['console'], 'level': 'INFO'},
+        'foodgram.images': {'handlers': ['console'], 'level': 'WARNING'},
+        'foodgram.recipe_index': {'handlers': ['console'],
+                                  'level': 'WARNING'},
+    },
+}
+
 CORS_ORIGIN_ALLOW_ALL = True
 
 CORS_URLS_REGEX = r'^/api/.*$'
@@ -124,7 +181,7 @@ REST_FRAMEWORK = {
     ],
 
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
 
     'PAGE_SIZE': 5,
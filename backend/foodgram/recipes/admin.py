@@ -22,9 +22,9 @@ class RecipeAdmin(admin.ModelAdmin):
     list_filter = ('name', 'author', 'tags')
     readonly_fields = ('added_to_favourites',)
 
-    @admin.display()
+    @admin.display(ordering='favourites_count')
     def added_to_favourites(self, obj):
-        return obj.favourites.count()
+        return obj.favourites_count
 
 
 @admin.register(RecipeIngredient)
@@ -0,0 +1,127 @@
+from django.conf import settings
+from django.db import connections, router
+from django.db.models import Q
+from users.models import Subscription
+
+from .models import FeedItem, Recipe
+
+MERGE = 'merge'
+INBOX = 'inbox'
+BATCH_SIZE = 1000
+MERGE_MAX_AUTHORS = 300
+
+# Для каждого автора из подписок берётся не больше limit последних
+# рецептов по индексу recipe_author_pub_date_idx, затем из них
+# выбираются limit самых новых: объём работы зависит от числа подписок
+# и размера страницы, но не от числа рецептов у авторов. При подписке
+# больше чем на MERGE_MAX_AUTHORS авторов дешевле идти по общему индексу
+# recipe_pub_date_id_idx, отбрасывая чужие рецепты
+MERGE_SQL = '''
+SELECT recipe.pub_date, recipe.id
+FROM {subscription} AS subscription
+CROSS JOIN LATERAL (
+    SELECT pub_date, id FROM {recipe}
+    WHERE author_id = subscription.author_id{keyset}
+    ORDER BY pub_date DESC, id DESC
+    LIMIT %s
+) AS recipe
+WHERE subscription.user_id = %s
+ORDER BY recipe.pub_date DESC, recipe.id DESC
+LIMIT %s
+'''
+
+
+def inbox_enabled():
+    return settings.FEED_STRATEGY == INBOX
+
+
+def get_keyset_filter(field, position):
+    pub_date, pk = position
+    return Q(pub_date__lt=pub_date) | Q(pub_date=pub_date,
+                                        **{f'{field}__lt': pk})
+
+
+def get_keys(user, position, limit):
+    """Ключи (pub_date, id) не больше limit рецептов ленты пользователя,
+    идущих после position, новые сначала"""
+    if inbox_enabled():
+        queryset = FeedItem.objects.filter(user=user)
+        if position is not None:
+            queryset = queryset.filter(get_keyset_filter('recipe_id',
+                                                         position))
+        return list(queryset.order_by('-pub_date', '-recipe_id')
+                    .values_list('pub_date', 'recipe_id')[:limit])
+
+    connection = connections[router.db_for_read(Recipe)]
+    if (connection.vendor == 'postgresql'
+            and Subscription.objects.filter(user=user)[
+                :MERGE_MAX_AUTHORS + 1].count() <= MERGE_MAX_AUTHORS):
+        sql = MERGE_SQL.format(
+            subscription=Subscription._meta.db_table,
+            recipe=Recipe._meta.db_table,
+            keyset=' AND (pub_date, id) < (%s, %s)' if position else '')
+        params = [*(position or ()), limit, user.id, limit]
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+
+    queryset = Recipe.objects.filter(author__recipe_author__user=user)
+    if position is not None:
+        queryset = queryset.filter(get_keyset_filter('id', position))
+    return list(queryset.order_by('-pub_date', '-id')
+                .values_list('pub_date', 'id')[:limit])
+
+
+def add_recipe(recipe):
+    """Раскладывает новый рецепт по лентам подписчиков автора"""
+    if not inbox_enabled():
+        return
+    FeedItem.objects.bulk_create(
+        (FeedItem(user_id=user_id, recipe_id=recipe.id,
+                  pub_date=recipe.pub_date)
+         for user_id in Subscription.objects.filter(
+             author_id=recipe.author_id).values_list('user_id', flat=True)),
+        batch_size=BATCH_SIZE, ignore_conflicts=True)
+
+
+def subscribe(user_id, author_ids):
+    """Добавляет в ленту рецепты новых авторов из подписок"""
+    if not inbox_enabled():
+        return
+    FeedItem.objects.bulk_create(
+        (FeedItem(user_id=user_id, recipe_id=pk, pub_date=pub_date)
+         for pk, pub_date in Recipe.objects.filter(
+             author_id__in=author_ids).values_list('id', 'pub_date')),
+        batch_size=BATCH_SIZE, ignore_conflicts=True)
+
+
+def unsubscribe(user_id, author_ids):
+    """Убирает из ленты рецепты авторов, от которых пользователь
+    отписался"""
+    if inbox_enabled():
+        FeedItem.objects.filter(
+            user_id=user_id, recipe__author_id__in=author_ids).delete()
+
+
+def rebuild(user_ids=None):
+    """Пересобирает ленты пользователей user_ids (по умолчанию - всех)
+    по подпискам"""
+    items = FeedItem.objects.all()
+    subscriptions = Subscription.objects.order_by()
+    if user_ids is not None:
+        items = items.filter(user_id__in=user_ids)
+        subscriptions = subscriptions.filter(user_id__in=user_ids)
+    items.delete()
+    rows = (subscriptions.filter(author__recipes__isnull=False)
+            .values_list('user_id', 'author__recipes__id',
+                         'author__recipes__pub_date')
+            .iterator(chunk_size=BATCH_SIZE))
+    count, batch = 0, []
+    for user_id, recipe_id, pub_date in rows:
+        batch.append(FeedItem(user_id=user_id, recipe_id=recipe_id,
+                              pub_date=pub_date))
+        if len(batch) == BATCH_SIZE:
+            FeedItem.objects.bulk_create(batch)
+            count, batch = count + len(batch), []
+    FeedItem.objects.bulk_create(batch)
+    return count + len(batch)
@@ -0,0 +1,63 @@
+import logging
+from math import ceil
+
+from django.conf import settings
+from sorl.thumbnail import get_thumbnail
+from sorl.thumbnail.engines.pil_engine import Engine as PILEngine
+
+logger = logging.getLogger('foodgram.images')
+
+
+class Engine(PILEngine):
+    """Движок sorl, который декодирует JPEG сразу в уменьшенном
+    масштабе (Image.draft): для превью 150x150 с фотографии 8000x6000
+    не нужно разворачивать в памяти все 48 млн пикселей"""
+
+    def create(self, image, geometry, options):
+        width, height = image.size
+        # Поворот по EXIF может поменять стороны местами
+        factor = max(
+            self._calculate_scaling_factor(width, height, geometry, options),
+            self._calculate_scaling_factor(height, width, geometry, options))
+        if factor < 1 and not options.get('cropbox'):
+            image.draft(image.mode,
+                        (ceil(width * factor), ceil(height * factor)))
+        return super().create(image, geometry, options)
+
+
+def generate_image_variants(image):
+    """Создаёт уменьшенные копии изображения рецепта.
+
+    Возвращает описание вариантов, которое хранится в Recipe.image_variants,
+    чтобы при сериализации не обращаться к файловой системе. Если файла
+    нет, он больше RECIPE_IMAGE_MAX_PIXELS или его не удалось прочитать,
+    возвращает {} и пишет в лог:
+    рецепт сохраняется без вариантов, generate_recipe_images создаст их
+    позже.
+    """
+    if not image:
+        return {}
+    if not image.storage.exists(image.name):
+        logger.warning('Нет файла изображения %s', image.name)
+        return {}
+    # Размеры читаются из заголовка; слишком большое изображение не
+    # декодируется (например, загруженное через админку)
+    if (image.width and image.height and image.width * image.height
+            > settings.RECIPE_IMAGE_MAX_PIXELS):
+        logger.warning('Изображение %s слишком большое: %sx%s',
+                       image.name, image.width, image.height)
+        return {}
+    variants = {}
+    for name, (geometry, options) in settings.RECIPE_IMAGE_VARIANTS.items():
+        thumbnail = get_thumbnail(image, geometry,
+                                  format=settings.RECIPE_IMAGE_FORMAT,
+                                  **options)
+        # При ошибке чтения sorl возвращает ImageFile без размеров
+        if not thumbnail.name or thumbnail.size is None:
+            logger.warning('Не удалось создать вариант %s изображения %s',
+                           name, image.name)
+            return {}
+        variants[name] = {'name': thumbnail.name,
+                          'width': thumbnail.width,
+                          'height': thumbnail.height}
+    return {'source': image.name, 'variants': variants}
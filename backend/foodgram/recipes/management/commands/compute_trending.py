@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from recipes import trending
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает trending_score рецептов по добавлениям в '
+            'избранное и списки покупок; запускается по расписанию.')
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        count = trending.recompute()
+        self.stdout.write(self.style.SUCCESS(
+            f'Рецептов с ненулевым счётом: {count}'))
@@ -0,0 +1,136 @@
+import base64
+import random
+import time
+import uuid
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from recipes import shopping_lists
+from recipes.models import (Favourite, Ingredient, Recipe, RecipeIngredient,
+                            ShoppingList, Tag)
+from users.models import CustomUser, Subscription
+
+IMAGE_NAME = 'recipes/images/generated.png'
+IMAGE = base64.b64decode(
+    'iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAC'
+    'hwGA60e6kgAAAABJRU5ErkJggg==')
+TAGS = (('Завтрак', '#E26C2D', 'breakfast'),
+        ('Обед', '#49B64E', 'lunch'),
+        ('Ужин', '#8775D2', 'dinner'))
+WORDS = ('суп', 'салат', 'пирог', 'каша', 'рагу', 'запеканка', 'омлет',
+         'паста', 'котлеты', 'плов', 'блины', 'соус', 'домашний', 'быстрый',
+         'овощной', 'сырный', 'куриный', 'грибной', 'летний', 'острый')
+
+
+def random_pairs(count, left, right, exclude_equal=False):
+    """Не больше count случайных уникальных пар из двух списков id"""
+    count = min(count, len(left) * len(right))
+    pairs = set()
+    attempts = count * 3
+    while len(pairs) < count and attempts:
+        attempts -= 1
+        pair = (random.choice(left), random.choice(right))
+        if not (exclude_equal and pair[0] == pair[1]):
+            pairs.add(pair)
+    return pairs
+
+
+class Command(BaseCommand):
+    help = ('Заполняет базу синтетическими пользователями, рецептами, '
+            'избранным, списками покупок и подписками.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--recipes', type=int, default=1000)
+        parser.add_argument('--ingredients-per-recipe', type=int, default=8)
+        parser.add_argument('--favourites', type=int, default=5000)
+        parser.add_argument('--carts', type=int, default=2000)
+        parser.add_argument('--subscriptions', type=int, default=1000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        started = time.monotonic()
+        batch_size = options['batch_size']
+
+        if not Ingredient.objects.exists():
+            call_command('load_ingredients', stdout=self.stdout)
+        ingredient_ids = list(Ingredient.objects.values_list('id', flat=True))
+        per_recipe = min(options['ingredients_per_recipe'],
+                         len(ingredient_ids))
+        if options['recipes'] and not per_recipe:
+            raise CommandError('Для рецептов нужны ингредиенты.')
+        for name, color, slug in TAGS:
+            Tag.objects.get_or_create(slug=slug, defaults={'name': name,
+                                                           'color': color})
+        tag_ids = list(Tag.objects.values_list('id', flat=True))
+        if not default_storage.exists(IMAGE_NAME):
+            default_storage.save(IMAGE_NAME, ContentFile(IMAGE))
+
+        with transaction.atomic():
+            prefix = f'gen{uuid.uuid4().hex[:8]}'
+            password = make_password(None)
+            users = CustomUser.objects.bulk_create(
+                (CustomUser(username=f'{prefix}_{number}',
+                            email=f'{prefix}_{number}@example.com',
+                            first_name='Имя', last_name='Фамилия',
+                            password=password)
+                 for number in range(options['users'])),
+                batch_size=batch_size)
+            user_ids = list(
+                CustomUser.objects.filter(username__startswith=f'{prefix}_')
+                .values_list('id', flat=True))
+            if options['recipes'] and not user_ids:
+                raise CommandError('Для рецептов нужны пользователи.')
+
+            Recipe.objects.bulk_create(
+                (Recipe(author_id=random.choice(user_ids),
+                        name=' '.join(random.sample(WORDS, 3)).capitalize()
+                        + f' {number}',
+                        text=' '.join(random.choices(WORDS, k=30)),
+                        image=IMAGE_NAME,
+                        cooking_time=random.randint(5, 180))
+                 for number in range(options['recipes'])),
+                batch_size=batch_size)
+            recipe_ids = list(Recipe.objects.filter(
+                author_id__in=user_ids).values_list('id', flat=True))
+
+            Recipe.tags.through.objects.bulk_create(
+                (Recipe.tags.through(recipe_id=recipe_id, tag_id=tag_id)
+                 for recipe_id in recipe_ids
+                 for tag_id in random.sample(
+                     tag_ids, random.randint(1, len(tag_ids)))),
+                batch_size=batch_size)
+            RecipeIngredient.objects.bulk_create(
+                (RecipeIngredient(recipe_id=recipe_id,
+                                  ingredient_id=ingredient_id,
+                                  amount=random.randint(1, 500))
+                 for recipe_id in recipe_ids
+                 for ingredient_id in random.sample(ingredient_ids,
+                                                    per_recipe)),
+                batch_size=batch_size)
+            for model, count in ((Favourite, options['favourites']),
+                                 (ShoppingList, options['carts'])):
+                model.objects.bulk_create(
+                    (model(user_id=user_id, recipe_id=recipe_id)
+                     for user_id, recipe_id in random_pairs(
+                         count, user_ids, recipe_ids)),
+                    batch_size=batch_size, ignore_conflicts=True)
+            Subscription.objects.bulk_create(
+                (Subscription(user_id=user_id, author_id=author_id)
+                 for user_id, author_id in random_pairs(
+                     options['subscriptions'], user_ids, user_ids,
+                     exclude_equal=True)),
+                batch_size=batch_size, ignore_conflicts=True)
+            call_command('recount', stdout=self.stdout)
+            shopping_lists.rebuild(user_ids)
+            call_command('compute_trending', stdout=self.stdout)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Пользователей: {len(users)}, рецептов: {len(recipe_ids)}, '
+            f'время: {time.monotonic() - started:.2f} с'))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from recipes.images import generate_image_variants
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Создаёт уменьшенные копии изображений рецептов.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true',
+                            help='пересоздать варианты для всех рецептов')
+
+    def handle(self, *args, **options):
+        updated = 0
+        for recipe in Recipe.objects.only('id', 'image', 'image_variants'):
+            source = recipe.image.name if recipe.image else None
+            if (not options['force']
+                    and recipe.image_variants.get('source') == source):
+                continue
+            Recipe.objects.filter(pk=recipe.pk).update(
+                image_variants=generate_image_variants(recipe.image))
+            updated += 1
+        self.stdout.write(self.style.SUCCESS(f'Обновлено рецептов: {updated}'))
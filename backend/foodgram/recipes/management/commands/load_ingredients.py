@@ -0,0 +1,102 @@
+import csv
+import json
+import os
+import re
+import time
+from itertools import islice
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from recipes.models import Ingredient
+from recipes.signals import ingredients_loaded
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.dirname(
+    settings.BASE_DIR)), 'data', 'ingredients.csv')
+JSON_CHUNK_SIZE = 64 * 1024
+SEPARATOR = re.compile(r'[\s,]*')
+
+
+def read_csv(file):
+    """Пропускает пустые строки, на неполных останавливает загрузку"""
+    reader = csv.reader(file)
+    for row in reader:
+        if not any(cell.strip() for cell in row):
+            continue
+        if len(row) < 2:
+            raise CommandError(
+                f'Строка {reader.line_num}: ожидаются название '
+                'и единица измерения.')
+        yield row[0], row[1]
+
+
+def read_json(file):
+    """Построчно читает JSON-массив объектов, не загружая файл целиком"""
+    decoder = json.JSONDecoder()
+    buffer = file.read(JSON_CHUNK_SIZE).lstrip()
+    if not buffer.startswith('['):
+        raise CommandError('Ожидается JSON-массив ингредиентов.')
+    position = 1
+    while True:
+        position = SEPARATOR.match(buffer, position).end()
+        if buffer.startswith(']', position):
+            return
+        try:
+            item, position = decoder.raw_decode(buffer, position)
+        except ValueError:
+            chunk = file.read(JSON_CHUNK_SIZE)
+            if not chunk:
+                raise CommandError('Некорректный JSON-файл.')
+            buffer = buffer[position:] + chunk
+            position = 0
+            continue
+        yield item['name'], item['measurement_unit']
+
+
+class Command(BaseCommand):
+    help = 'Загружает ингредиенты из CSV или JSON пачками.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default=DEFAULT_PATH)
+        parser.add_argument('--format', choices=('csv', 'json'),
+                            help='по умолчанию - по расширению файла')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format'] or os.path.splitext(path)[1][1:].lower()
+        readers = {'csv': read_csv, 'json': read_json}
+        if format not in readers:
+            raise CommandError(f'Неизвестный формат файла: {path}')
+
+        started = time.monotonic()
+        count_before = Ingredient.objects.count()
+        seen = set()
+        total = 0
+        try:
+            with open(path, encoding='utf-8') as file, transaction.atomic():
+                rows = readers[format](file)
+                while True:
+                    chunk = list(islice(rows, options['batch_size']))
+                    if not chunk:
+                        break
+                    total += len(chunk)
+                    batch = []
+                    for name, measurement_unit in chunk:
+                        key = (name.strip(), measurement_unit.strip())
+                        if key not in seen:
+                            seen.add(key)
+                            batch.append(Ingredient(
+                                name=key[0], measurement_unit=key[1]))
+                    Ingredient.objects.bulk_create(batch,
+                                                   ignore_conflicts=True)
+        except OSError as error:
+            raise CommandError(error)
+
+        inserted = Ingredient.objects.count() - count_before
+        if inserted:
+            ingredients_loaded.send(sender=Ingredient)
+        self.stdout.write(self.style.SUCCESS(
+            f'Прочитано: {total}, добавлено: {inserted}, '
+            f'пропущено: {total - inserted}, '
+            f'время: {time.monotonic() - started:.2f} с'))
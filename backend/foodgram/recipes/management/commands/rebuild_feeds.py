@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from recipes import feeds
+
+
+class Command(BaseCommand):
+    help = ('Пересобирает ленты подписок (FeedItem) для '
+            'FEED_STRATEGY = inbox.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append',
+                            dest='users',
+                            help='id пользователя; по умолчанию все')
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        count = feeds.rebuild(options['users'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Записей в лентах: {count}'))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from recipes import shopping_lists
+
+
+class Command(BaseCommand):
+    help = ('Пересобирает итоги списков покупок (ShoppingListIngredient) '
+            'по рецептам в корзинах пользователей.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append',
+                            dest='users',
+                            help='id пользователя; по умолчанию все')
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        count = shopping_lists.rebuild(options['users'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Пересчитано строк списков покупок: {count}'))
@@ -0,0 +1,21 @@
+from core.counters import count_subquery
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from recipes.models import Favourite, Recipe, ShoppingList
+from users.models import CustomUser, Subscription
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает счётчики избранного, списков покупок, '
+            'рецептов и подписчиков.')
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.update(
+            favourites_count=count_subquery(Favourite, 'recipe'),
+            in_carts_count=count_subquery(ShoppingList, 'recipe'))
+        users = CustomUser.objects.update(
+            recipes_count=count_subquery(Recipe, 'author'),
+            subscribers_count=count_subquery(Subscription, 'author'))
+        self.stdout.write(self.style.SUCCESS(
+            f'Пересчитано рецептов: {recipes}, пользователей: {users}'))
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.19 on 2026-10-18 03:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0009_recipe_recipe_pub_date_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False, help_text='Размеры и пути уменьшенных копий изображения', verbose_name='Варианты изображения'),
+        ),
+    ]
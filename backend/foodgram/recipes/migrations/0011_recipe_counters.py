@@ -0,0 +1,48 @@
+# Generated by Django 3.2.19 on 2026-10-18 03:18
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_recipe_relations(apps, schema_editor):
+    CustomUser = apps.get_model('users', 'CustomUser')
+    Recipe = apps.get_model('recipes', 'Recipe')
+
+    def count(model_name, field):
+        model = apps.get_model('recipes', model_name)
+        return Coalesce(Subquery(
+            model.objects.filter(**{field: OuterRef('pk')}).order_by()
+            .values(field).annotate(count=Count('pk')).values('count'),
+            output_field=models.IntegerField()), 0)
+
+    Recipe.objects.update(favourites_count=count('Favourite', 'recipe'),
+                          in_carts_count=count('ShoppingList', 'recipe'))
+    CustomUser.objects.update(recipes_count=count('Recipe', 'author'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0009_customuser_counters'),
+        ('recipes', '0010_recipe_image_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favourites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Сколько раз рецепт добавлен в избранное', verbose_name='В избранном'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='in_carts_count',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Сколько раз рецепт добавлен в список покупок', verbose_name='В списках покупок'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-favourites_count', '-pub_date'], name='recipe_popular_idx'),
+        ),
+        migrations.RunPython(count_recipe_relations,
+                             migrations.RunPython.noop),
+    ]
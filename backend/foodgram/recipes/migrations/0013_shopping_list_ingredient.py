@@ -0,0 +1,46 @@
+# Generated by Django 3.2.19 on 2026-10-18 03:38
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import F, Sum
+
+
+def fill_shopping_list_ingredients(apps, schema_editor):
+    ShoppingList = apps.get_model('recipes', 'ShoppingList')
+    ShoppingListIngredient = apps.get_model('recipes',
+                                            'ShoppingListIngredient')
+    rows = (ShoppingList.objects.filter(recipe__ingredient__isnull=False)
+            .order_by()
+            .values('user_id',
+                    ingredient_id=F('recipe__ingredient__ingredient_id'))
+            .annotate(amount=Sum('recipe__ingredient__amount')))
+    ShoppingListIngredient.objects.bulk_create(
+        (ShoppingListIngredient(**row) for row in rows.iterator()),
+        batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0012_recipe_search_vector'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShoppingListIngredient',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.PositiveIntegerField(default=0, help_text='Сумма по всем рецептам списка', verbose_name='Количество')),
+                ('ingredient', models.ForeignKey(help_text='Ингредиент в списке покупок', on_delete=django.db.models.deletion.CASCADE, related_name='shopping_lists', to='recipes.ingredient', verbose_name='Ингредиент')),
+                ('user', models.ForeignKey(help_text='Владелец списка', on_delete=django.db.models.deletion.CASCADE, related_name='shopping_list_ingredients', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='shoppinglistingredient',
+            constraint=models.UniqueConstraint(fields=('user', 'ingredient'), name='shopping_list_ingredient_user_unique'),
+        ),
+        migrations.RunPython(fill_shopping_list_ingredients,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.19 on 2026-10-18 04:28
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0015_trending'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='recipe',
+            options={'base_manager_name': 'objects', 'ordering': ('-pub_date',)},
+        ),
+    ]
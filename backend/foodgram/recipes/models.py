@@ -1,4 +1,6 @@
+from core.counters import CounterFieldsMixin
 from core.validators import hex_validator
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MinValueValidator, validate_slug
 from django.db import models
 from users.models import CustomUser
@@ -57,7 +59,20 @@ class Ingredient(models.Model):
         return f'{self.name} {self.measurement_unit}'
 
 
-class Recipe(models.Model):
+class RecipeManager(models.Manager):
+    """Не загружает search_vector: вектор нужен только в условиях и
+    сортировке поиска, а в каждой строке выборки занимает больше места,
+    чем остальные поля рецепта"""
+
+    def get_queryset(self):
+        return super().get_queryset().defer('search_vector')
+
+
+class Recipe(CounterFieldsMixin, models.Model):
+    counter_fields = ('favourites_count', 'in_carts_count', 'trending_score')
+
+    objects = RecipeManager()
+
     author = models.ForeignKey(
         CustomUser,
         on_delete=models.CASCADE,
@@ -75,6 +90,13 @@ class Recipe(models.Model):
         upload_to='recipes/images/',
         blank=True
     )
+    image_variants = models.JSONField(
+        default=dict,
+        blank=True,
+        editable=False,
+        verbose_name='Варианты изображения',
+        help_text='Размеры и пути уменьшенных копий изображения'
+    )
     text = models.TextField(
         verbose_name='Текст',
         help_text='Текст рецепта'
@@ -108,9 +130,48 @@ class Recipe(models.Model):
         verbose_name='Дата публикации',
         help_text='Дата публикации поста'
     )
+    favourites_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='В избранном',
+        help_text='Сколько раз рецепт добавлен в избранное'
+    )
+    in_carts_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='В списках покупок',
+        help_text='Сколько раз рецепт добавлен в список покупок'
+    )
+    trending_score = models.FloatField(
+        default=0,
+        editable=False,
+        verbose_name='Популярность сейчас',
+        help_text='ln суммы затухающих весов добавлений в избранное '
+                  'и списки покупок'
+    )
+    # На PostgreSQL заполняется триггером из миграции 0012 и индексируется
+    # GIN-индексом, на других СУБД остаётся пустым
+    search_vector = SearchVectorField(
+        null=True,
+        editable=False,
+        verbose_name='Поисковый вектор',
+        help_text='Название и текст рецепта для полнотекстового поиска'
+    )
 
     class Meta:
         ordering = ('-pub_date',)
+        # Связанные рецепты (favourite.recipe и т.п.) тоже без вектора
+        base_manager_name = 'objects'
+        indexes = [
+            models.Index(fields=['-pub_date', '-id'],
+                         name='recipe_pub_date_id_idx'),
+            models.Index(fields=['-favourites_count', '-pub_date'],
+                         name='recipe_popular_idx'),
+            models.Index(fields=['author', '-pub_date', '-id'],
+                         name='recipe_author_pub_date_idx'),
+            models.Index(fields=['-trending_score', '-pub_date'],
+                         name='recipe_trending_idx'),
+        ]
 
         constraints = [
             models.UniqueConstraint(
@@ -208,6 +269,45 @@ class ShoppingList(models.Model):
         return f'{self.recipe} {self.user}'
 
 
+class ShoppingListIngredient(models.Model):
+    """Суммарное количество ингредиента в списке покупок пользователя.
+
+    Поддерживается сигналами при изменении ShoppingList и RecipeIngredient,
+    пересобирается командой rebuild_shopping_lists.
+    """
+    user = models.ForeignKey(
+        CustomUser,
+        on_delete=models.CASCADE,
+        related_name='shopping_list_ingredients',
+        verbose_name='Пользователь',
+        help_text='Владелец списка'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='shopping_lists',
+        verbose_name='Ингредиент',
+        help_text='Ингредиент в списке покупок'
+    )
+    amount = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Количество',
+        help_text='Сумма по всем рецептам списка'
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='shopping_list_ingredient_user_unique'
+            )
+
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.user} {self.ingredient}'
+
+
 class Favourite(models.Model):
     recipe = models.ForeignKey(
         Recipe,
@@ -240,3 +340,68 @@ class Favourite(models.Model):
 
     def __str__(self) -> str:
         return f'{self.recipe} {self.user}'
+
+
+class FeedItem(models.Model):
+    """Рецепт в ленте подписок пользователя.
+
+    Заполняется при FEED_STRATEGY = 'inbox' при публикации рецепта
+    и при подписке, пересобирается командой rebuild_feeds.
+    """
+    user = models.ForeignKey(
+        CustomUser,
+        on_delete=models.CASCADE,
+        related_name='feed',
+        verbose_name='Пользователь',
+        help_text='Владелец ленты'
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='feed_items',
+        verbose_name='Рецепт',
+        help_text='Рецепт в ленте'
+    )
+    pub_date = models.DateTimeField(
+        verbose_name='Дата публикации',
+        help_text='Дата публикации рецепта'
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-pub_date', '-recipe'],
+                         name='feed_item_user_pub_date_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='feed_item_user_recipe_unique'
+            )
+
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.user} {self.recipe}'
+
+
+class TrendingScore(models.Model):
+    """Счёт рецепта по последнему полному пересчёту compute_trending.
+
+    Из этой таблицы одним UPDATE переносится Recipe.trending_score,
+    по которому сортируется выдача.
+    """
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='trending',
+        verbose_name='Рецепт',
+        help_text='Рецепт'
+    )
+    score = models.FloatField(
+        verbose_name='Счёт',
+        help_text='Счёт на момент пересчёта'
+    )
+
+    def __str__(self) -> str:
+        return f'{self.recipe} {self.score}'
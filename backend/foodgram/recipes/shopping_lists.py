@@ -0,0 +1,97 @@
+from collections import Counter
+
+from django.db.models import Case, F, IntegerField, Sum, Value, When
+from django.db.models.functions import Greatest
+
+from .models import RecipeIngredient, ShoppingList, ShoppingListIngredient
+
+REBUILD_BATCH_SIZE = 1000
+
+
+def apply_deltas(user_ids, deltas):
+    """Прибавляет изменения {ingredient_id: количество} к итогам списков
+    покупок пользователей user_ids.
+
+    Недостающие строки вставляются с нулём через ON CONFLICT DO NOTHING,
+    затем все итоги меняются одним UPDATE с F()-выражением. Строки
+    с нулевым итогом остаются до rebuild: если удалять их здесь,
+    параллельный вызов может пропустить вставку существующей строки,
+    а его UPDATE уже не найдёт её после удаления.
+    """
+    deltas = {pk: delta for pk, delta in deltas.items() if delta}
+    if not user_ids or not deltas:
+        return
+    added = [pk for pk, delta in deltas.items() if delta > 0]
+    if added:
+        ShoppingListIngredient.objects.bulk_create(
+            [ShoppingListIngredient(user_id=user_id, ingredient_id=pk)
+             for user_id in user_ids for pk in added],
+            ignore_conflicts=True)
+    ShoppingListIngredient.objects.filter(
+        user_id__in=user_ids, ingredient_id__in=deltas).update(
+            amount=Greatest(F('amount') + Case(
+                *[When(ingredient_id=pk, then=Value(delta))
+                  for pk, delta in deltas.items()],
+                output_field=IntegerField()), 0))
+
+
+def get_recipe_amounts(recipe_ids):
+    amounts = Counter()
+    for ingredient_id, amount in (RecipeIngredient.objects
+                                  .filter(recipe_id__in=recipe_ids)
+                                  .values_list('ingredient_id', 'amount')):
+        amounts[ingredient_id] += amount
+    return amounts
+
+
+def add_recipes(user_id, recipe_ids):
+    """Добавляет ингредиенты рецептов в итоги списка покупок"""
+    apply_deltas([user_id], get_recipe_amounts(recipe_ids))
+
+
+def remove_recipes(user_id, recipe_ids):
+    """Вычитает ингредиенты рецептов из итогов списка покупок"""
+    apply_deltas([user_id], {pk: -amount for pk, amount
+                             in get_recipe_amounts(recipe_ids).items()})
+
+
+def change_recipe(recipe_id, deltas):
+    """Применяет изменения ингредиентов рецепта к спискам покупок всех
+    пользователей, у которых он в корзине"""
+    if any(deltas.values()):
+        apply_deltas(list(ShoppingList.objects.filter(recipe_id=recipe_id)
+                          .values_list('user_id', flat=True)), deltas)
+
+
+def delete_recipe(recipe_id):
+    """Вычитает рецепт из списков покупок всех пользователей перед его
+    удалением, одним набором изменений вместо обработки каждой строки
+    каскада"""
+    change_recipe(recipe_id, {pk: -amount for pk, amount
+                              in get_recipe_amounts([recipe_id]).items()})
+
+
+def rebuild(user_ids=None):
+    """Пересобирает итоги списков покупок пользователей user_ids (по
+    умолчанию - всех) по ShoppingList и RecipeIngredient"""
+    totals = ShoppingListIngredient.objects.all()
+    carts = ShoppingList.objects.filter(
+        recipe__ingredient__isnull=False).order_by()
+    if user_ids is not None:
+        totals = totals.filter(user_id__in=user_ids)
+        carts = carts.filter(user_id__in=user_ids)
+    totals.delete()
+    rows = (carts.values('user_id', ingredient_id=F(
+                         'recipe__ingredient__ingredient_id'))
+            .annotate(amount=Sum('recipe__ingredient__amount'))
+            .values_list('user_id', 'ingredient_id', 'amount')
+            .iterator(chunk_size=REBUILD_BATCH_SIZE))
+    count, batch = 0, []
+    for user_id, ingredient_id, amount in rows:
+        batch.append(ShoppingListIngredient(
+            user_id=user_id, ingredient_id=ingredient_id, amount=amount))
+        if len(batch) == REBUILD_BATCH_SIZE:
+            ShoppingListIngredient.objects.bulk_create(batch)
+            count, batch = count + len(batch), []
+    ShoppingListIngredient.objects.bulk_create(batch)
+    return count + len(batch)
@@ -0,0 +1,145 @@
+from collections import Counter
+from itertools import groupby
+from operator import attrgetter
+
+from core.counters import connect_counter
+from core.deletion import is_being_deleted
+from core.relations import relations_added, relations_removed
+from django.db.models.signals import (post_delete, post_save, pre_delete,
+                                      pre_save)
+from django.dispatch import Signal, receiver
+from users.models import CustomUser, Subscription
+
+from . import feeds, shopping_lists, trending
+from .images import generate_image_variants
+from .models import Favourite, Recipe, RecipeIngredient, ShoppingList
+
+# Отправляется после массовой загрузки ингредиентов в обход save()
+ingredients_loaded = Signal()
+
+connect_counter(Favourite, Recipe, 'recipe_id', 'favourites_count')
+connect_counter(ShoppingList, Recipe, 'recipe_id', 'in_carts_count')
+connect_counter(Recipe, CustomUser, 'author_id', 'recipes_count')
+
+
+@receiver(post_save, sender=Recipe)
+def add_to_feeds(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        feeds.add_recipe(instance)
+
+
+@receiver(post_save, sender=Recipe)
+def update_image_variants(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    source = instance.image.name if instance.image else None
+    if instance.image_variants.get('source') == source:
+        return
+    instance.image_variants = generate_image_variants(instance.image)
+    Recipe.objects.filter(pk=instance.pk).update(
+        image_variants=instance.image_variants)
+
+
+@receiver(post_save, sender=ShoppingList)
+def add_to_shopping_list(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        shopping_lists.add_recipes(instance.user_id, [instance.recipe_id])
+
+
+@receiver(post_delete, sender=ShoppingList)
+def remove_from_shopping_list(sender, instance, **kwargs):
+    if (is_being_deleted(Recipe, instance.recipe_id)
+            or is_being_deleted(CustomUser, instance.user_id)):
+        return
+    shopping_lists.remove_recipes(instance.user_id, [instance.recipe_id])
+
+
+def group_by_user(instances, field):
+    key = attrgetter('user_id')
+    for user_id, group in groupby(sorted(instances, key=key), key):
+        yield user_id, [getattr(instance, field) for instance in group]
+
+
+@receiver(relations_added, sender=ShoppingList)
+def add_many_to_shopping_list(sender, instances, **kwargs):
+    for user_id, recipe_ids in group_by_user(instances, 'recipe_id'):
+        shopping_lists.add_recipes(user_id, recipe_ids)
+
+
+@receiver(relations_removed, sender=ShoppingList)
+def remove_many_from_shopping_list(sender, instances, **kwargs):
+    for user_id, recipe_ids in group_by_user(instances, 'recipe_id'):
+        shopping_lists.remove_recipes(user_id, recipe_ids)
+
+
+@receiver(pre_save, sender=RecipeIngredient)
+def remember_recipe_ingredient(sender, instance, raw=False, **kwargs):
+    instance._previous = None
+    if not raw and not instance._state.adding:
+        instance._previous = RecipeIngredient.objects.filter(
+            pk=instance.pk).values_list(
+                'recipe_id', 'ingredient_id', 'amount').first()
+
+
+@receiver(post_save, sender=RecipeIngredient)
+def update_shopping_lists(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    deltas = Counter({(instance.recipe_id, instance.ingredient_id):
+                      instance.amount})
+    if instance._previous is not None:
+        recipe_id, ingredient_id, amount = instance._previous
+        deltas[recipe_id, ingredient_id] -= amount
+    for (recipe_id, ingredient_id), delta in deltas.items():
+        shopping_lists.change_recipe(recipe_id, {ingredient_id: delta})
+
+
+@receiver(post_delete, sender=RecipeIngredient)
+def remove_from_shopping_lists(sender, instance, **kwargs):
+    if is_being_deleted(Recipe, instance.recipe_id):
+        return
+    shopping_lists.change_recipe(
+        instance.recipe_id, {instance.ingredient_id: -instance.amount})
+
+
+@receiver(pre_delete, sender=Recipe)
+def remove_recipe_from_shopping_lists(sender, instance, **kwargs):
+    # Строки ShoppingList и RecipeIngredient удаляются каскадом после
+    # этого, их обработчики видят is_being_deleted и ничего не делают
+    shopping_lists.delete_recipe(instance.pk)
+
+
+@receiver(post_save, sender=Subscription)
+def add_author_to_feed(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        feeds.subscribe(instance.user_id, [instance.author_id])
+
+
+@receiver(post_delete, sender=Subscription)
+def remove_author_from_feed(sender, instance, **kwargs):
+    feeds.unsubscribe(instance.user_id, [instance.author_id])
+
+
+@receiver(relations_added, sender=Subscription)
+def add_authors_to_feed(sender, instances, **kwargs):
+    for user_id, author_ids in group_by_user(instances, 'author_id'):
+        feeds.subscribe(user_id, author_ids)
+
+
+@receiver(relations_removed, sender=Subscription)
+def remove_authors_from_feed(sender, instances, **kwargs):
+    for user_id, author_ids in group_by_user(instances, 'author_id'):
+        feeds.unsubscribe(user_id, author_ids)
+
+
+@receiver(post_save, sender=Favourite)
+@receiver(post_save, sender=ShoppingList)
+def bump_trending(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        trending.bump(sender, [instance.recipe_id])
+
+
+@receiver(relations_added, sender=Favourite)
+@receiver(relations_added, sender=ShoppingList)
+def bump_trending_many(sender, instances, **kwargs):
+    trending.bump(sender, [instance.recipe_id for instance in instances])
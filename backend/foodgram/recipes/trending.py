@@ -0,0 +1,72 @@
+import math
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from django.db.models import F, OuterRef, Q, Subquery, Value
+from django.db.models.functions import (Abs, Coalesce, Exp, Greatest,
+                                        Least, Ln)
+from django.utils import timezone
+
+from .models import Favourite, Recipe, ShoppingList, TrendingScore
+
+# Вес добавления падает вдвое за HALF_LIFE, добавления старше WINDOW
+# при пересчёте не учитываются
+HALF_LIFE = timedelta(days=1)
+WINDOW = timedelta(days=14)
+# Начало отсчёта: score = ln(сумма весов * 2 ** ((дата - EPOCH) /
+# HALF_LIFE)), поэтому порядок рецептов по score не зависит от времени
+# запроса, а новые добавления прибавляются без пересчёта старых
+EPOCH = datetime(2023, 1, 1, tzinfo=timezone.utc)
+# Дальше e ** -40 вклад меньшего слагаемого не виден в double
+MAX_EXPONENT_GAP = 40.0
+SOURCES = {
+    Favourite: ('date_added', 1.0),
+    ShoppingList: ('date_created', 1.0),
+}
+BATCH_SIZE = 1000
+
+
+def get_exponent(moment, weight):
+    return math.log(2) * (moment - EPOCH) / HALF_LIFE + math.log(weight)
+
+
+def bump(sender, recipe_ids):
+    """Прибавляет к score рецептов вес нового добавления sender одним
+    UPDATE: ln(e ** score + e ** x) = max + ln(1 + e ** -|score - x|)
+    """
+    _, weight = SOURCES[sender]
+    exponent = Value(get_exponent(timezone.now(), weight))
+    score = F('trending_score')
+    Recipe.objects.filter(pk__in=recipe_ids).update(
+        trending_score=Greatest(score, exponent) + Ln(1.0 + Exp(
+            -Least(Abs(score - exponent), Value(MAX_EXPONENT_GAP)))))
+
+
+def recompute(now=None):
+    """Пересчитывает score всех рецептов за один проход по добавлениям
+    в избранное и списки покупок за WINDOW.
+
+    Счета сохраняются в TrendingScore и переносятся в
+    Recipe.trending_score одним UPDATE с подзапросом. Возвращает число
+    рецептов с ненулевым score.
+    """
+    now = now or timezone.now()
+    totals = defaultdict(float)
+    for model, (field, weight) in SOURCES.items():
+        rows = (model.objects.filter(**{f'{field}__gte': now - WINDOW})
+                .values_list('recipe_id', field)
+                .iterator(chunk_size=BATCH_SIZE))
+        for recipe_id, moment in rows:
+            totals[recipe_id] += weight * 2 ** ((moment - now) / HALF_LIFE)
+    offset = get_exponent(now, 1)
+    TrendingScore.objects.all().delete()
+    TrendingScore.objects.bulk_create(
+        [TrendingScore(recipe_id=recipe_id, score=math.log(total) + offset)
+         for recipe_id, total in totals.items()],
+        batch_size=BATCH_SIZE)
+    score = Subquery(TrendingScore.objects.filter(
+        recipe=OuterRef('pk')).values('score'))
+    Recipe.objects.filter(
+        ~Q(trending_score=0) | Q(trending__isnull=False)).update(
+            trending_score=Coalesce(score, 0.0))
+    return len(totals)
@@ -1,20 +1,8 @@
-import csv
-import os
-
-from recipes.models import Ingredient
-
-PROJECT_DIR = os.path.dirname(os.path.dirname(os.getcwd()))
+from django.core.management import call_command
 
 
 def run():
-    with open(f'{PROJECT_DIR}/data/ingredients.csv') as file:
-        reader = csv.reader(file)
-
-        for row in reader:
-            _, ingredient = Ingredient.objects.get_or_create(
-                name=row[0],
-                measurement_unit=row[1]
-            )
+    call_command('load_ingredients')
 
 
 if __name__ == "__main__":
@@ -7,6 +7,7 @@ from .models import CustomUser, Subscription
 class CustomUserAdmin(admin.ModelAdmin):
     list_display = (
         'username', 'pk', 'email', 'password', 'first_name', 'last_name',
+        'recipes_count', 'subscribers_count',
     )
     list_filter = ('username', 'email')
     search_fields = ('username', 'email')
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.19 on 2026-10-18 03:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0007_alter_subscription_author'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='subscription',
+            index=models.Index(fields=['user', '-subscription_date', '-id'], name='subscription_user_date_idx'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 3.2.19 on 2026-10-18 03:18
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_subscribers(apps, schema_editor):
+    CustomUser = apps.get_model('users', 'CustomUser')
+    Subscription = apps.get_model('users', 'Subscription')
+    CustomUser.objects.update(subscribers_count=Coalesce(Subquery(
+        Subscription.objects.filter(author=OuterRef('pk')).order_by()
+        .values('author').annotate(count=Count('pk')).values('count'),
+        output_field=models.IntegerField()), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0008_subscription_subscription_user_date_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='recipes_count',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Количество рецептов пользователя', verbose_name='Рецептов'),
+        ),
+        migrations.AddField(
+            model_name='customuser',
+            name='subscribers_count',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Количество подписчиков пользователя', verbose_name='Подписчиков'),
+        ),
+        migrations.RunPython(count_subscribers, migrations.RunPython.noop),
+    ]
@@ -1,13 +1,28 @@
+from core.counters import CounterFieldsMixin
 from django.contrib.auth.models import AbstractUser
 from django.db import models
 
 
-class CustomUser(AbstractUser):
+class CustomUser(CounterFieldsMixin, AbstractUser):
+    counter_fields = ('recipes_count', 'subscribers_count')
+
     email = models.EmailField(
         max_length=254,
         verbose_name='email',
         unique=True
     )
+    recipes_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Рецептов',
+        help_text='Количество рецептов пользователя'
+    )
+    subscribers_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Подписчиков',
+        help_text='Количество подписчиков пользователя'
+    )
 
     class Meta:
         ordering = ('username',)
@@ -39,6 +54,10 @@ class Subscription(models.Model):
 
     class Meta:
         ordering = ('-subscription_date',)
+        indexes = [
+            models.Index(fields=['user', '-subscription_date', '-id'],
+                         name='subscription_user_date_idx'),
+        ]
         constraints = [
             models.UniqueConstraint(
                 fields=['author', 'user'],
@@ -0,0 +1,5 @@
+from core.counters import connect_counter
+
+from .models import CustomUser, Subscription
+
+connect_counter(Subscription, CustomUser, 'author_id', 'subscribers_count')